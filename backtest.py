@@ -0,0 +1,222 @@
+import argparse
+import csv
+import itertools
+import logging
+import os
+import time
+from collections import defaultdict, deque
+from types import SimpleNamespace
+from typing import Deque, Dict, Iterable, Tuple
+
+import tick_taker
+from tick_taker import PRICE_SCALE, QUOTE, TRADE, Quote, Runner, TickTakerStrategy, Trade, to_ticks
+
+# (kind, timestamp_ns, symbol, a, b, c, d)
+#   quote: a = bid ticks, b = ask ticks, c = bid size, d = ask size
+#   trade: a = price ticks, b = size, c and d unused
+Event = Tuple[str, int, str, int, int, int, int]
+
+
+def read_csv_events(path: str) -> Iterable[Event]:
+    # Columns: kind,timestamp,symbol,bid_price,ask_price,bid_size,ask_size,price,size (timestamp in epoch nanoseconds)
+    with open(path, newline='') as file:
+        for row in csv.DictReader(file):
+            if row['kind'] == QUOTE:
+                yield (
+                    QUOTE,
+                    int(row['timestamp']),
+                    row['symbol'],
+                    to_ticks(row['bid_price']),
+                    to_ticks(row['ask_price']),
+                    int(float(row['bid_size'])),
+                    int(float(row['ask_size']))
+                )
+            else:
+                yield TRADE, int(row['timestamp']), row['symbol'], to_ticks(row['price']), int(float(row['size'])), 0, 0
+
+
+class SimulatedBroker:
+    """Stands in for trade_api.REST, filling IOC limit orders immediately against the latest quote."""
+
+    def __init__(self, lot_size: int = 1):
+        # Quote sizes are multiplied by this to get the shares available at the touch
+        self.lot_size = lot_size
+        self.quotes: Dict[str, Quote] = {}
+        self.positions: Dict[str, float] = defaultdict(float)
+        self.cash = 0.0
+        self.orders = 0
+        self.fills = 0
+        self.turnover = 0.0
+        self.updates: Deque[SimpleNamespace] = deque()
+        self.ids = itertools.count(1)
+
+    def on_quote(self, quote: Quote):
+        self.quotes[quote.symbol] = quote
+
+    def submit_order(self, symbol: str, qty: str, side: str, type: str, time_in_force: str, limit_price: str,
+                     client_order_id: str = None):
+        order_id = str(next(self.ids))
+        quantity = float(qty)
+        limit_ticks = to_ticks(limit_price)
+        self.orders += 1
+
+        # Marketable if the limit crosses the touch; fill up to the displayed size and cancel the rest
+        quote = self.quotes.get(symbol)
+        filled = 0.0
+        if quote is not None:
+            if side == 'buy' and limit_ticks >= quote.ask_ticks:
+                filled = min(quantity, quote.ask_size * self.lot_size)
+                self.execute(symbol, filled, quote.ask_ticks)
+            elif side == 'sell' and limit_ticks <= quote.bid_ticks:
+                filled = min(quantity, quote.bid_size * self.lot_size)
+                self.execute(symbol, -filled, quote.bid_ticks)
+
+        order = {
+            'id': order_id,
+            'client_order_id': client_order_id,
+            'symbol': symbol,
+            'side': side,
+            'qty': qty,
+            'filled_qty': '0'
+        }
+        self.updates.append(SimpleNamespace(event='new', order=order))
+        if filled:
+            event = 'fill' if filled == quantity else 'partial_fill'
+            self.updates.append(SimpleNamespace(event=event, order=dict(order, filled_qty=str(filled))))
+        if filled < quantity:
+            self.updates.append(SimpleNamespace(event='canceled', order=dict(order, filled_qty=str(filled))))
+
+        return SimpleNamespace(id=order_id, client_order_id=client_order_id, symbol=symbol, side=side, qty=qty)
+
+    def close_position(self, symbol: str):
+        # Flatten at the touch, ignoring displayed size
+        position = self.positions[symbol]
+        quote = self.quotes.get(symbol)
+        if not position or quote is None:
+            return
+        self.execute(symbol, -position, quote.bid_ticks if position > 0 else quote.ask_ticks)
+
+    def execute(self, symbol: str, quantity: float, price_ticks: int):
+        if not quantity:
+            return
+        notional = quantity * price_ticks / PRICE_SCALE
+        self.positions[symbol] += quantity
+        self.cash -= notional
+        self.fills += 1
+        self.turnover += abs(notional)
+
+    def summary(self) -> Dict[str, float]:
+        # Mark any open position to the latest mid
+        equity = self.cash
+        for symbol, position in self.positions.items():
+            quote = self.quotes.get(symbol)
+            if position and quote is not None:
+                equity += position * (quote.bid_ticks + quote.ask_ticks) / 2 / PRICE_SCALE
+        return {'pnl': equity, 'orders': self.orders, 'fills': self.fills, 'turnover': self.turnover}
+
+
+class BacktestRunner(Runner):
+    """Replays recorded quotes and trades through the strategies, with SimulatedBroker in place of the REST API."""
+
+    def __init__(self, lot_size: int = 1, reuse_quotes: bool = True):
+        super().__init__(reuse_quotes=reuse_quotes)
+        self.api = SimulatedBroker(lot_size)
+        self.events = 0
+
+    def start(self):
+        for strategy in self.strategies:
+            strategy.start()
+
+    def stop(self):
+        for strategy in self.strategies:
+            strategy.stop()
+
+    def run(self, events: Iterable[Event]) -> Dict[str, float]:
+        self.start()
+
+        broker = self.api
+        updates = broker.updates
+        scratch = self.scratch_quotes
+        for kind, timestamp_ns, symbol, a, b, c, d in events:
+            if kind == QUOTE:
+                quote = scratch.get(symbol) if self.reuse_quotes else None
+                if quote is None:
+                    quote = Quote(symbol, a, b, c, d, timestamp_ns)
+                    if self.reuse_quotes:
+                        scratch[symbol] = quote
+                else:
+                    quote.update(a, b, c, d, timestamp_ns)
+                broker.on_quote(quote)
+                self.dispatch_quote(quote)
+            else:
+                self.dispatch_trade(Trade(symbol, a, b, timestamp_ns))
+
+            # Deliver any order updates the strategies' submissions generated before the next market event
+            while updates:
+                self.dispatch_trade_update(updates.popleft())
+            self.events += 1
+
+        self.stop()
+        return broker.summary()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.WARNING)
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        'events', type=str,
+        help='Tape directory recorded with --record, or a CSV of quotes and trades ordered by time.'
+    )
+    parser.add_argument(
+        '--symbol', type=str, action='append', required=True,
+        help='Symbol to trade; repeat for several.'
+    )
+    parser.add_argument(
+        '--quantity', type=int, default=500,
+        help='Maximum number of shares to hold at once.'
+    )
+    parser.add_argument(
+        '--threshold', type=float, default=tick_taker.IMBALANCE_THRESHOLD,
+        help='Bid/ask size imbalance required to trade.'
+    )
+    parser.add_argument(
+        '--lot-size', type=int, default=1,
+        help='Shares per unit of quoted size.'
+    )
+    parser.add_argument(
+        '--quantity-per-trade', type=int, default=100,
+        help='Shares per order.'
+    )
+    parser.add_argument(
+        '--stale-ms', type=float, default=tick_taker.STALE_NS / 1e6,
+        help='Ignore trades this many milliseconds after a level change.'
+    )
+    parser.add_argument(
+        '--min-trade-size', type=int, default=tick_taker.MIN_TRADE_SIZE,
+        help='Ignore trades smaller than this.'
+    )
+    args = parser.parse_args()
+
+    runner = BacktestRunner(lot_size=args.lot_size)
+    runner.add_strategy(*[
+        TickTakerStrategy(
+            symbol,
+            args.quantity,
+            args.quantity_per_trade,
+            imbalance_threshold=args.threshold,
+            stale_ns=int(args.stale_ms * 1e6),
+            min_trade_size=args.min_trade_size
+        )
+        for symbol in args.symbol
+    ])
+    started = time.perf_counter()
+    if os.path.isdir(args.events):
+        from tape import TapeReader
+        events = TapeReader(args.events).events()
+    else:
+        events = read_csv_events(args.events)
+    result = runner.run(events)
+    elapsed = time.perf_counter() - started
+    print(f'{runner.events} events in {elapsed:.2f}s ({runner.events / elapsed:,.0f}/s)')
+    print(', '.join(f'{key}: {value:,.2f}' for key, value in result.items()))
@@ -0,0 +1,249 @@
+import argparse
+import asyncio
+import logging
+import os
+import random
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from types import SimpleNamespace
+from typing import Callable, Dict, List
+
+import pandas as pd
+
+from backtest import BacktestRunner
+from tick_taker import ONE_CENT, PRICE_SCALE, Runner, TickTakerStrategy
+
+# Run in a fresh interpreter for each start-up sample: reports the import time and the wall clock as Runner.start is
+# called, then runs until killed
+STARTUP_SCRIPT = '''
+import sys
+import time
+started = time.perf_counter_ns()
+import tick_taker
+imported = time.perf_counter_ns()
+print(imported - started, 'pandas' in sys.modules, time.time_ns(), flush=True)
+runner = tick_taker.Runner()
+runner.add_strategy(tick_taker.TickTakerStrategy('SNAP'))
+runner.start()
+'''
+
+def quote_messages(symbol: str, count: int, bid_ticks: int = 100_000) -> List[SimpleNamespace]:
+    # Stand-ins for the stream's quote entities: a one-cent market whose bid walks a cent at a time
+    started = pd.Timestamp.now(tz='America/New_York')
+    messages = []
+    for i in range(count):
+        bid_ticks += random.choice((-ONE_CENT, 0, ONE_CENT))
+        messages.append(SimpleNamespace(
+            symbol=symbol,
+            bid_price=bid_ticks / PRICE_SCALE,
+            ask_price=(bid_ticks + ONE_CENT) / PRICE_SCALE,
+            bid_size=random.randint(1, 10),
+            ask_size=random.randint(1, 10),
+            timestamp=started + pd.Timedelta(i, unit='ms')
+        ))
+    return messages
+
+
+def trade_messages(quotes: List[SimpleNamespace]) -> List[SimpleNamespace]:
+    # One trade at the ask a second after each quote, so each passes the staleness check
+    return [
+        SimpleNamespace(
+            symbol=quote.symbol, price=quote.ask_price, size=100, timestamp=quote.timestamp + pd.Timedelta(seconds=1)
+        )
+        for quote in quotes
+    ]
+
+
+def runner_for(symbol: str, reuse_quotes: bool, risk: bool = False) -> BacktestRunner:
+    runner = BacktestRunner(reuse_quotes=reuse_quotes)
+    if risk:
+        # Every limit checked, none ever reached: the replay runs far faster than real time, so the per-second cap
+        # is out of reach too
+        from risk import RiskChecker
+        runner.risk = RiskChecker(1e9, 1e9, 1_000, 10 ** 9, 0.01)
+    runner.add_strategy(TickTakerStrategy(symbol))
+    runner.start()
+    return runner
+
+
+def bench_quotes(args: argparse.Namespace) -> Dict[str, float]:
+    # Runner.on_quote: convert the stream's entity, log, and route to the strategy
+    count = args.count
+    messages = quote_messages('SNAP', count)
+    runner = runner_for('SNAP', args.reuse_quotes, args.risk)
+    on_quote = runner.on_quote
+    started = time.perf_counter_ns()
+    for message in messages:
+        on_quote(message)
+    return {'ns_per_event': (time.perf_counter_ns() - started) / count}
+
+
+def bench_trades(args: argparse.Namespace) -> Dict[str, float]:
+    # Runner.on_trade, each trade following a quote; the quotes are fed in untimed
+    count = args.count
+    quotes = quote_messages('SNAP', count)
+    trades = trade_messages(quotes)
+    runner = runner_for('SNAP', args.reuse_quotes, args.risk)
+    updates = runner.api.updates
+    elapsed = 0
+    for quote, trade in zip(quotes, trades):
+        runner.on_quote(quote)
+        started = time.perf_counter_ns()
+        runner.on_trade(trade)
+        elapsed += time.perf_counter_ns() - started
+        while updates:
+            runner.dispatch_trade_update(updates.popleft())
+    return {'ns_per_event': elapsed / count, 'orders': runner.api.orders}
+
+
+def bench_startup(args: argparse.Namespace) -> Dict[str, float]:
+    # Cold start in a fresh interpreter: `import tick_taker`, then Runner.start up to its stream subscription, against
+    # the local mock REST API and stream
+    from mock_rest import MockRestServer
+    from mock_stream import MockStreamServer
+
+    stream = MockStreamServer(port=args.mock_port)
+    rest = MockRestServer(stream, port=args.mock_port + 1)
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, name='mocks', daemon=True).start()
+    asyncio.run_coroutine_threadsafe(stream.start(), loop).result()
+    asyncio.run_coroutine_threadsafe(rest.start(), loop).result()
+
+    environment = dict(
+        os.environ,
+        APCA_API_KEY_ID='benchmark',
+        APCA_API_SECRET_KEY='benchmark',
+        APCA_API_BASE_URL=f'http://127.0.0.1:{args.mock_port + 1}',
+        APCA_API_STREAM_URL=f'http://127.0.0.1:{args.mock_port}'
+    )
+    imports = []
+    starts = []
+    pandas_imported = False
+    try:
+        for _ in range(args.runs):
+            subscriptions = len(stream.subscribed_at)
+            process = subprocess.Popen(
+                [sys.executable, '-c', STARTUP_SCRIPT], cwd=os.path.dirname(os.path.abspath(__file__)),
+                env=environment, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True
+            )
+            try:
+                import_ns, pandas_imported, start_ns = process.stdout.readline().split()
+                while len(stream.subscribed_at) == subscriptions and process.poll() is None:
+                    time.sleep(0.001)
+                if len(stream.subscribed_at) == subscriptions:
+                    raise RuntimeError('Runner exited before subscribing')
+                imports.append(int(import_ns))
+                starts.append(stream.subscribed_at[subscriptions] - int(start_ns))
+            finally:
+                process.kill()
+                process.wait()
+    finally:
+        asyncio.run_coroutine_threadsafe(rest.stop(), loop).result()
+        asyncio.run_coroutine_threadsafe(stream.stop(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+
+    return {
+        'import_ms': statistics.median(imports) / 1e6,
+        'start_to_subscribe_ms': statistics.median(starts) / 1e6,
+        'import_loads_pandas': pandas_imported == 'True'
+    }
+
+
+def bench_liquidation(args: argparse.Namespace) -> Dict[str, float]:
+    # Runner.liquidate against the local mock REST API, with a position open in every symbol: one close at a time, as
+    # the strategies used to stop, and then --liquidation-workers at a time
+    import alpaca_trade_api as trade_api
+    from mock_rest import MockRestServer
+
+    rest = MockRestServer(latency=args.rest_latency_ms / 1000, port=args.mock_port + 1)
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, name='mocks', daemon=True).start()
+    asyncio.run_coroutine_threadsafe(rest.start(), loop).result()
+    api = trade_api.REST('benchmark', 'benchmark', f'http://127.0.0.1:{args.mock_port + 1}')
+
+    results = {}
+    try:
+        for count in args.symbol_counts:
+            symbols = [f'S{i:04}' for i in range(count)]
+            for label, workers in (('serial', 1), ('concurrent', args.liquidation_workers)):
+                runner = Runner(liquidation_workers=workers)
+                runner.api = api
+                runner.pool.mount(api)
+                runner.add_strategy(*[TickTakerStrategy(symbol) for symbol in symbols])
+                rest.positions = dict.fromkeys(symbols, 100.0)
+                started = time.perf_counter_ns()
+                failed = runner.liquidate()
+                results[f'{label}_ms_{count}'] = (time.perf_counter_ns() - started) / 1e6
+                if failed:
+                    raise RuntimeError(f'Could not liquidate {", ".join(failed)}')
+    finally:
+        asyncio.run_coroutine_threadsafe(rest.stop(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+    return results
+
+
+BENCHMARKS: Dict[str, Callable[[argparse.Namespace], Dict[str, float]]] = {
+    'quotes': bench_quotes,
+    'trades': bench_trades,
+    'startup': bench_startup,
+    'liquidation': bench_liquidation,
+}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        'benchmark', type=str, nargs='*', default=list(BENCHMARKS),
+        help=f"Benchmarks to run, of {', '.join(BENCHMARKS)} (default all)."
+    )
+    parser.add_argument(
+        '--count', type=int, default=100_000,
+        help='Events per benchmark.'
+    )
+    parser.add_argument(
+        '--runs', type=int, default=5,
+        help='Start-ups to time; the medians are reported.'
+    )
+    parser.add_argument(
+        '--mock-port', type=int, default=8775,
+        help='Port for the start-up benchmark\'s mock stream; the mock REST API listens on the next one.'
+    )
+    parser.add_argument(
+        '--symbol-counts', type=int, nargs='+', default=[10, 50, 100, 200],
+        help='Numbers of open positions to liquidate.'
+    )
+    parser.add_argument(
+        '--liquidation-workers', type=int, default=16,
+        help='Positions to close at once, as Runner(liquidation_workers=...).'
+    )
+    parser.add_argument(
+        '--rest-latency-ms', type=float, default=20.0,
+        help='Delay before each mock REST response in the liquidation benchmark, in milliseconds.'
+    )
+    parser.add_argument(
+        '--reuse-quotes', action='store_true',
+        help='Overwrite one quote object per symbol, as with tick_taker.py --reuse-quotes.'
+    )
+    parser.add_argument(
+        '--risk', action='store_true',
+        help='Check every order against pre-trade risk limits (see risk.py) in the quotes and trades benchmarks.'
+    )
+    parser.add_argument(
+        '--log-level', type=str, default='INFO',
+        help='Logging level, as tick_taker.py logs by default; output is discarded.'
+    )
+    args = parser.parse_args()
+    for name in args.benchmark:
+        if name not in BENCHMARKS:
+            parser.error(f'Unknown benchmark {name}')
+    logging.basicConfig(stream=open(os.devnull, 'w'), level=args.log_level)
+
+    random.seed(1)
+    for name in args.benchmark:
+        result = BENCHMARKS[name](args)
+        print(f'{name}: ' + ', '.join(
+            f'{key}: {value}' if isinstance(value, bool) else f'{key}: {value:,.0f}' for key, value in result.items()
+        ))
@@ -0,0 +1,123 @@
+import functools
+import logging
+import threading
+import time
+from collections import defaultdict
+from typing import Callable, Dict, Iterator, Tuple
+
+# Histograms bucket log-linearly: 2**SUB_BUCKET_BITS buckets per power of two, so each bucket is within ~6% of its
+# values, and 64-bit nanosecond values need at most BUCKETS buckets
+SUB_BUCKET_BITS = 4
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+BUCKETS = SUB_BUCKETS * (64 - SUB_BUCKET_BITS + 1)
+
+# Intervals measured for each order, in report order
+#   decide: trade received from the stream -> strategy hands an order to the gateway
+#   queue:  handed to the gateway -> REST request started on a gateway worker
+#   ack:    REST request started -> submit_order returned
+#   total:  trade received -> submit_order returned
+STAGES = ('decide', 'queue', 'ack', 'total')
+PERCENTILES = (50.0, 99.0, 99.9)
+
+
+def bucket_index(value: int) -> int:
+    if value < SUB_BUCKETS:
+        return max(value, 0)
+    shift = value.bit_length() - SUB_BUCKET_BITS - 1
+    return SUB_BUCKETS * (shift + 1) + (value >> shift) - SUB_BUCKETS
+
+
+def bucket_value(index: int) -> int:
+    # The midpoint of the values a bucket holds
+    if index < SUB_BUCKETS:
+        return index
+    shift = index // SUB_BUCKETS - 1
+    low = (index % SUB_BUCKETS + SUB_BUCKETS) << shift
+    return low + (1 << shift) // 2
+
+
+class LatencyHistogram:
+    """Fixed-size log-linear histogram of nanosecond durations; recording is a couple of integer operations."""
+
+    __slots__ = ('counts', 'count', 'max')
+
+    def __init__(self):
+        self.counts = [0] * BUCKETS
+        self.count = 0
+        self.max = 0
+
+    def record(self, value: int):
+        self.counts[bucket_index(value)] += 1
+        self.count += 1
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, percentile: float) -> int:
+        if not self.count:
+            return 0
+        rank = max(1, round(self.count * percentile / 100))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bucket_value(index), self.max)
+        return self.max
+
+
+class LatencyMonitor:
+    """Per-symbol tick-to-order latency histograms, fed by the runner's stream callbacks and its order gateway."""
+
+    def __init__(self):
+        # perf_counter_ns at which the trade each symbol is handling was received from the stream, which may be well
+        # before it was handled if it was queued behind others
+        self.received: Dict[str, int] = {}
+        self.histograms: Dict[Tuple[str, str], LatencyHistogram] = defaultdict(LatencyHistogram)
+
+        # Gateway workers finish orders concurrently. Re-entrant, as the SIGUSR1 handler may interrupt the main thread while
+        # it holds the lock, which it does when an order is submitted inline.
+        self.lock = threading.RLock()
+
+    def on_receipt(self, symbol: str, received_ns: int):
+        # Called as each trade is handed to the strategies, so an order it prompts is timed from its own receipt
+        self.received[symbol] = received_ns
+
+    def timed(self, symbol: str, submit: Callable) -> Callable:
+        # Called as the strategy decides to send an order; wraps its REST submission to time the rest of the way
+        decided = time.perf_counter_ns()
+        return functools.partial(self.submit, symbol, self.received.get(symbol), decided, submit)
+
+    def submit(self, symbol: str, received: int, decided: int, submit: Callable):
+        sent = time.perf_counter_ns()
+        try:
+            return submit()
+        finally:
+            acked = time.perf_counter_ns()
+            with self.lock:
+                if received is not None:
+                    self.histograms[symbol, 'decide'].record(decided - received)
+                    self.histograms[symbol, 'total'].record(acked - received)
+                self.histograms[symbol, 'queue'].record(sent - decided)
+                self.histograms[symbol, 'ack'].record(acked - sent)
+
+    def rows(self) -> Iterator[Tuple[str, str, LatencyHistogram]]:
+        # Gateway workers add a histogram the first time a symbol reaches a stage, so take the keys under the lock
+        with self.lock:
+            histograms = dict(self.histograms)
+        for symbol in sorted({symbol for symbol, _ in histograms}):
+            for stage in STAGES:
+                histogram = histograms.get((symbol, stage))
+                if histogram is not None and histogram.count:
+                    yield symbol, stage, histogram
+
+    def report(self) -> str:
+        lines = [f"{'symbol':<8} {'stage':<7} {'count':>8} " + ' '.join(f'{f"p{p:g}":>10}' for p in PERCENTILES)
+                 + f" {'max':>10}  (µs)"]
+        for symbol, stage, histogram in self.rows():
+            values = [histogram.percentile(p) for p in PERCENTILES] + [histogram.max]
+            lines.append(f'{symbol:<8} {stage:<7} {histogram.count:>8} '
+                         + ' '.join(f'{value / 1_000:>10.1f}' for value in values))
+        return '\n'.join(lines)
+
+    def dump(self):
+        # Called from the SIGUSR1 handler too, on the main thread while gateway workers keep recording
+        logging.info(f'Tick-to-order latency\n{self.report()}')
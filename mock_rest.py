@@ -0,0 +1,306 @@
+import argparse
+import asyncio
+import json
+import logging
+import random
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Set, Union
+
+from aiohttp import WSMsgType, web
+
+from mock_stream import MockStreamServer
+from tape import TapeReader
+
+# Point the SDK at the mock by setting APCA_API_BASE_URL to http://HOST:PORT; this serves the REST endpoints the runner
+# uses under /v2 and the trading (trade_updates) websocket on /stream
+
+
+class MockRestServer:
+    """Local stand-in for Alpaca's trading REST API and trading stream, with configurable latency and fills."""
+
+    def __init__(self, stream: Union[MockStreamServer, None] = None, latency: float = 0.0, reject_rate: float = 0.0,
+                 fill_rate: float = 1.0, partial_rate: float = 0.0, fill_latency: float = 0.0,
+                 close_in: float = 390.0, host: str = '127.0.0.1', port: int = 8766):
+        # Probabilities: reject_rate of submissions fail with an API error; of the rest, fill_rate fill in full and
+        # partial_rate fill in part (then cancel, as IOC orders do), and the remainder are cancelled unfilled
+        self.stream = stream
+        self.latency = latency
+        self.reject_rate = reject_rate
+        self.fill_rate = fill_rate
+        self.partial_rate = partial_rate
+        self.fill_latency = fill_latency
+        self.next_close = datetime.now(timezone.utc) + timedelta(minutes=close_in)
+        self.host = host
+        self.port = port
+        self.runner: Union[web.AppRunner, None] = None
+
+        self.positions: Dict[str, float] = {}
+        self.trading_clients: Set[web.WebSocketResponse] = set()
+        self.tasks: Set[asyncio.Task] = set()
+
+        # Counters, and tick-to-order latencies in ns when paired with a mock stream
+        self.orders = 0
+        self.rejections = 0
+        self.tick_to_order: List[int] = []
+
+        self.app = web.Application()
+        self.app.add_routes([
+            web.get('/v2/clock', self.get_clock),
+            web.get('/v2/account', self.get_account),
+            web.get('/v2/positions', self.list_positions),
+            web.delete('/v2/positions', self.close_all_positions),
+            web.get('/v2/positions/{symbol}', self.get_position),
+            web.delete('/v2/positions/{symbol}', self.close_position),
+            web.post('/v2/orders', self.submit_order),
+            web.get('/stream', self.handle_trading),
+            web.get('/stream/', self.handle_trading),
+        ])
+
+    async def start(self):
+        self.runner = web.AppRunner(self.app)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, self.host, self.port).start()
+        logging.info(f'Mock REST listening on http://{self.host}:{self.port}')
+
+    async def stop(self):
+        for task in list(self.tasks):
+            task.cancel()
+        for websocket in list(self.trading_clients):
+            await websocket.close()
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
+
+    @staticmethod
+    def error(status: int, code: int, message: str) -> web.Response:
+        return web.json_response({'code': code, 'message': message}, status=status)
+
+    async def get_clock(self, request: web.Request) -> web.Response:
+        now = datetime.now(timezone.utc)
+        return web.json_response({
+            'timestamp': now.isoformat(),
+            'is_open': True,
+            'next_open': (now + timedelta(days=1)).isoformat(),
+            'next_close': self.next_close.isoformat()
+        })
+
+    async def get_account(self, request: web.Request) -> web.Response:
+        return web.json_response({'id': 'mock', 'status': 'ACTIVE', 'currency': 'USD', 'buying_power': '1000000'})
+
+    def position(self, symbol: str) -> dict:
+        qty = self.positions.get(symbol, 0.0)
+        return {'symbol': symbol, 'qty': str(qty), 'side': 'long' if qty >= 0 else 'short'}
+
+    async def list_positions(self, request: web.Request) -> web.Response:
+        await asyncio.sleep(self.latency)
+        return web.json_response([self.position(symbol) for symbol, qty in self.positions.items() if qty])
+
+    async def get_position(self, request: web.Request) -> web.Response:
+        await asyncio.sleep(self.latency)
+        symbol = request.match_info['symbol']
+        if not self.positions.get(symbol):
+            return self.error(404, 40410000, 'position does not exist')
+        return web.json_response(self.position(symbol))
+
+    async def close_position(self, request: web.Request) -> web.Response:
+        await asyncio.sleep(self.latency)
+        symbol = request.match_info['symbol']
+        qty = self.positions.get(symbol, 0.0)
+        if not qty:
+            return self.error(404, 40410000, 'position does not exist')
+        order = self.new_order(symbol, abs(qty), 'sell' if qty > 0 else 'buy', 'market', 'day')
+        self.schedule(self.execute(order, abs(qty)))
+        return web.json_response(order)
+
+    async def close_all_positions(self, request: web.Request) -> web.Response:
+        await asyncio.sleep(self.latency)
+        results = []
+        for symbol, qty in list(self.positions.items()):
+            if qty:
+                order = self.new_order(symbol, abs(qty), 'sell' if qty > 0 else 'buy', 'market', 'day')
+                self.schedule(self.execute(order, abs(qty)))
+                results.append({'symbol': symbol, 'status': 200, 'body': order})
+        return web.json_response(results)
+
+    async def submit_order(self, request: web.Request) -> web.Response:
+        received = time.perf_counter_ns()
+        params = await request.json()
+        symbol = params['symbol']
+        if self.stream is not None and symbol in self.stream.sent_at:
+            self.tick_to_order.append(received - self.stream.sent_at[symbol])
+        self.orders += 1
+
+        await asyncio.sleep(self.latency)
+        if random.random() < self.reject_rate:
+            self.rejections += 1
+            return self.error(403, 40310000, 'insufficient buying power')
+
+        qty = float(params['qty'])
+        order = self.new_order(
+            symbol, qty, params['side'], params['type'], params['time_in_force'], params.get('limit_price'),
+            params.get('client_order_id')
+        )
+        roll = random.random()
+        if roll < self.fill_rate:
+            filled = qty
+        elif roll < self.fill_rate + self.partial_rate and qty > 1:
+            filled = float(random.randint(1, int(qty) - 1))
+        else:
+            filled = 0.0
+        self.schedule(self.execute(order, filled))
+        return web.json_response(order)
+
+    @staticmethod
+    def new_order(symbol: str, qty: float, side: str, type: str, time_in_force: str, limit_price: str = None,
+                  client_order_id: str = None) -> dict:
+        return {
+            'id': str(uuid.uuid4()),
+            'client_order_id': client_order_id or str(uuid.uuid4()),
+            'created_at': datetime.now(timezone.utc).isoformat(),
+            'symbol': symbol,
+            'qty': str(qty),
+            'filled_qty': '0',
+            'side': side,
+            'type': type,
+            'time_in_force': time_in_force,
+            'limit_price': limit_price,
+            'status': 'new'
+        }
+
+    def schedule(self, coroutine):
+        task = asyncio.ensure_future(coroutine)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def execute(self, order: dict, filled: float):
+        # Acknowledge, then after the fill latency fill (some or all of) the order and cancel any remainder
+        await self.publish_trade_update('new', order)
+        await asyncio.sleep(self.fill_latency)
+        qty = float(order['qty'])
+        if filled:
+            symbol = order['symbol']
+            self.positions[symbol] = self.positions.get(symbol, 0.0) + (filled if order['side'] == 'buy' else -filled)
+            event = 'fill' if filled == qty else 'partial_fill'
+            order = dict(order, filled_qty=str(filled), status='filled' if filled == qty else 'partially_filled')
+            await self.publish_trade_update(
+                event, order, price=order['limit_price'], qty=str(filled), position_qty=str(self.positions[symbol])
+            )
+        if filled < qty:
+            await self.publish_trade_update('canceled', dict(order, status='canceled'))
+
+    async def handle_trading(self, request: web.Request) -> web.WebSocketResponse:
+        websocket = web.WebSocketResponse()
+        await websocket.prepare(request)
+        await websocket.receive()
+        await websocket.send_str(json.dumps({
+            'stream': 'authorization', 'data': {'action': 'authenticate', 'status': 'authorized'}
+        }))
+        self.trading_clients.add(websocket)
+        try:
+            async for message in websocket:
+                if message.type != WSMsgType.TEXT:
+                    continue
+                streams = json.loads(message.data).get('data', {}).get('streams', [])
+                await websocket.send_str(json.dumps({'stream': 'listening', 'data': {'streams': streams}}))
+        finally:
+            self.trading_clients.discard(websocket)
+        return websocket
+
+    async def publish_trade_update(self, event: str, order: dict, **fields):
+        message = json.dumps({
+            'stream': 'trade_updates',
+            'data': dict(fields, event=event, order=order, timestamp=datetime.now(timezone.utc).isoformat())
+        })
+        for websocket in list(self.trading_clients):
+            try:
+                await websocket.send_str(message)
+            except ConnectionError:
+                self.trading_clients.discard(websocket)
+
+    def report(self) -> str:
+        summary = f'{self.orders} orders, {self.rejections} rejected'
+        if self.tick_to_order:
+            latencies = sorted(self.tick_to_order)
+            p50 = latencies[len(latencies) // 2] / 1e6
+            p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] / 1e6
+            summary += f'; tick-to-order p50 {p50:.3f}ms, p99 {p99:.3f}ms'
+        return summary
+
+
+async def serve(rest: MockRestServer, stream: Union[MockStreamServer, None], report_interval: float = 5.0):
+    if stream is not None:
+        await stream.start()
+    await rest.start()
+    try:
+        while True:
+            await asyncio.sleep(report_interval)
+            logging.info(rest.report())
+    finally:
+        await rest.stop()
+        if stream is not None:
+            await stream.stop()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        'tape', type=str, nargs='?', default=None,
+        help='Tape directory recorded with --record to replay on a mock market data stream as well.'
+    )
+    parser.add_argument(
+        '--port', type=int, default=8766,
+        help='Port for the REST API and trading stream.'
+    )
+    parser.add_argument(
+        '--stream-port', type=int, default=8765,
+        help='Port for the market data stream.'
+    )
+    parser.add_argument(
+        '--speed', type=float, default=1.0,
+        help='Replay speed: 1 for real time, N for N times faster, 0 for as fast as possible.'
+    )
+    parser.add_argument(
+        '--restamp', action='store_true',
+        help='Stamp replayed events with the time they are sent instead of the recorded time.'
+    )
+    parser.add_argument(
+        '--latency-ms', type=float, default=0.0,
+        help='Delay before each REST response, in milliseconds.'
+    )
+    parser.add_argument(
+        '--fill-latency-ms', type=float, default=0.0,
+        help='Delay between accepting and filling an order, in milliseconds.'
+    )
+    parser.add_argument(
+        '--reject-rate', type=float, default=0.0,
+        help='Fraction of submitted orders rejected with an API error.'
+    )
+    parser.add_argument(
+        '--fill-rate', type=float, default=1.0,
+        help='Fraction of accepted orders filled in full.'
+    )
+    parser.add_argument(
+        '--partial-rate', type=float, default=0.0,
+        help='Fraction of accepted orders filled in part.'
+    )
+    args = parser.parse_args()
+
+    stream = MockStreamServer(TapeReader(args.tape), args.speed, args.restamp, port=args.stream_port) \
+        if args.tape else None
+    rest = MockRestServer(
+        stream,
+        latency=args.latency_ms / 1000,
+        reject_rate=args.reject_rate,
+        fill_rate=args.fill_rate,
+        partial_rate=args.partial_rate,
+        fill_latency=args.fill_latency_ms / 1000,
+        port=args.port
+    )
+    try:
+        asyncio.run(serve(rest, stream))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,213 @@
+import argparse
+import asyncio
+import itertools
+import logging
+import random
+import time
+from typing import Dict, Iterable, List, Set, Union
+
+import msgpack
+import websockets
+
+from tape import TapeReader
+from tick_taker import ONE_CENT, PRICE_SCALE
+
+# Point the SDK at the mock by setting APCA_API_STREAM_URL to http://HOST:PORT; the market data stream is served on
+# /v2/<feed>. The trading stream shares its host with the REST API, so it is served by mock_rest.MockRestServer.
+
+
+class MockStreamServer:
+    """Local stand-in for Alpaca's market data websocket, replaying a recorded tape."""
+
+    def __init__(self, tape: Union[TapeReader, None] = None, speed: float = 1.0, restamp: bool = False,
+                 host: str = '127.0.0.1', port: int = 8765, batch_size: int = 100):
+        # A speed of 1 replays in real time, N replays N times faster and 0 replays as fast as possible
+        self.tape = tape
+        self.speed = speed
+        self.restamp = restamp
+        self.host = host
+        self.port = port
+        self.batch_size = batch_size
+        self.server = None
+
+        # Each data client's subscribed symbols, by event kind
+        self.data_clients: Dict[object, Dict[str, Set[str]]] = {}
+        self.trade_ids = itertools.count(1)
+
+        # Counters, and the perf_counter_ns at which each symbol's latest event was sent, for tick-to-order latency
+        self.sent = 0
+        self.started_ns = 0
+        self.sent_at: Dict[str, int] = {}
+
+        # time.time_ns() of each data client's first subscription, for measuring client start-up
+        self.subscribed_at: List[int] = []
+
+    async def start(self):
+        self.server = await websockets.serve(self.handle, self.host, self.port, max_size=None)
+        logging.info(f'Mock stream listening on ws://{self.host}:{self.port}')
+
+    async def stop(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+
+    async def handle(self, websocket, path: str):
+        if path.startswith('/v2/'):
+            await self.handle_data(websocket)
+        else:
+            await websocket.close(code=1008, reason=f'Unknown path {path}')
+
+    async def handle_data(self, websocket):
+        await websocket.send(msgpack.packb([{'T': 'success', 'msg': 'connected'}]))
+        await websocket.recv()
+        await websocket.send(msgpack.packb([{'T': 'success', 'msg': 'authenticated'}]))
+
+        # Wait for the first subscription, then replay the tape for it
+        message = msgpack.unpackb(await websocket.recv())
+        self.subscribed_at.append(time.time_ns())
+        symbols = {'Q': set(message.get('quotes', [])), 'T': set(message.get('trades', []))}
+        self.data_clients[websocket] = symbols
+        await websocket.send(msgpack.packb([{
+            'T': 'subscription', 'trades': message.get('trades', []), 'quotes': message.get('quotes', [])
+        }]))
+        try:
+            if self.tape is not None:
+                await self.replay(websocket, symbols)
+            await websocket.wait_closed()
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            del self.data_clients[websocket]
+
+    async def replay(self, websocket, symbols: Dict[str, Set[str]]):
+        events = self.tape.events()
+        first_ns = None
+        started = time.perf_counter_ns()
+        self.started_ns = self.started_ns or started
+        batch = []
+        for event in events:
+            if not self.is_subscribed(symbols, event[0], event[2]):
+                continue
+
+            # Pace by the tape's own clock, sending whatever is due as one frame
+            if self.speed:
+                first_ns = event[1] if first_ns is None else first_ns
+                delay_ns = (event[1] - first_ns) / self.speed - (time.perf_counter_ns() - started)
+                if delay_ns > 1_000_000:
+                    await self.send(websocket, batch)
+                    batch = []
+                    await asyncio.sleep(delay_ns / 1e9)
+            batch.append(self.encode(*event))
+            if len(batch) >= self.batch_size:
+                await self.send(websocket, batch)
+                batch = []
+        await self.send(websocket, batch)
+        logging.info(f'Replay finished after {self.sent} events')
+
+    @staticmethod
+    def is_subscribed(symbols: Dict[str, Set[str]], kind: str, symbol: str) -> bool:
+        return symbol in symbols[kind] or '*' in symbols[kind]
+
+    async def send(self, websocket, batch: List[dict]):
+        if not batch:
+            return
+        await websocket.send(msgpack.packb(batch))
+        now = time.perf_counter_ns()
+        for message in batch:
+            self.sent_at[message['S']] = now
+        self.sent += len(batch)
+
+        # Yield so other clients, and the bursts, get a turn when replaying flat out
+        await asyncio.sleep(0)
+
+    def encode(self, kind: str, timestamp_ns: int, symbol: str, a: int, b: int, c: int, d: int) -> dict:
+        timestamp = msgpack.Timestamp.from_unix_nano(time.time_ns() if self.restamp else timestamp_ns)
+        if kind == 'Q':
+            return {
+                'T': 'q', 'S': symbol, 'bx': 'V', 'bp': a / PRICE_SCALE, 'bs': c, 'ax': 'V', 'ap': b / PRICE_SCALE,
+                'as': d, 'c': ['R'], 'z': 'C', 't': timestamp
+            }
+        return {
+            'T': 't', 'S': symbol, 'i': next(self.trade_ids), 'x': 'V', 'p': a / PRICE_SCALE, 's': b, 'c': ['@'],
+            'z': 'C', 't': timestamp
+        }
+
+    async def burst(self, symbol: str, size: int, bid_ticks: int = 100_000, trade_every: int = 10):
+        # Send a synthetic burst of one-cent quotes walking the bid, with a trade at the ask every so often
+        events = []
+        now = time.time_ns()
+        for i in range(size):
+            bid_ticks += random.choice((-ONE_CENT, 0, ONE_CENT))
+            ask_ticks = bid_ticks + ONE_CENT
+            events.append(('Q', now + i, symbol, bid_ticks, ask_ticks, random.randint(1, 10), random.randint(1, 10)))
+            if trade_every and i % trade_every == trade_every - 1:
+                events.append(('T', now + i, symbol, ask_ticks, 100, 0, 0))
+        for websocket, symbols in list(self.data_clients.items()):
+            subscribed = [event for event in events if self.is_subscribed(symbols, event[0], symbol)]
+            for start in range(0, len(subscribed), self.batch_size):
+                await self.send(websocket, [self.encode(*event) for event in subscribed[start:start + self.batch_size]])
+
+    def throughput(self) -> float:
+        elapsed = (time.perf_counter_ns() - self.started_ns) / 1e9 if self.started_ns else 0
+        return self.sent / elapsed if elapsed else 0.0
+
+
+async def serve(server: MockStreamServer, bursts: Iterable[str] = (), burst_size: int = 0,
+                burst_interval: float = 0.0):
+    await server.start()
+    try:
+        while True:
+            await asyncio.sleep(burst_interval or 5)
+            if burst_size:
+                for symbol in bursts:
+                    await server.burst(symbol, burst_size)
+            logging.info(f'Sent {server.sent} events ({server.throughput():,.0f}/s)')
+    finally:
+        await server.stop()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        'tape', type=str, nargs='?', default=None,
+        help='Tape directory recorded with --record to replay.'
+    )
+    parser.add_argument(
+        '--port', type=int, default=8765,
+        help='Port to listen on.'
+    )
+    parser.add_argument(
+        '--speed', type=float, default=1.0,
+        help='Replay speed: 1 for real time, N for N times faster, 0 for as fast as possible.'
+    )
+    parser.add_argument(
+        '--restamp', action='store_true',
+        help='Stamp events with the time they are sent instead of the recorded time.'
+    )
+    parser.add_argument(
+        '--burst', type=str, action='append', default=[],
+        help='Symbol to send synthetic bursts for; repeat for several.'
+    )
+    parser.add_argument(
+        '--burst-size', type=int, default=1000,
+        help='Quotes per synthetic burst.'
+    )
+    parser.add_argument(
+        '--burst-interval', type=float, default=5.0,
+        help='Seconds between synthetic bursts.'
+    )
+    args = parser.parse_args()
+
+    tape = TapeReader(args.tape) if args.tape else None
+    try:
+        asyncio.run(serve(
+            MockStreamServer(tape, args.speed, args.restamp, port=args.port),
+            args.burst,
+            args.burst_size if args.burst else 0,
+            args.burst_interval
+        ))
+    except KeyboardInterrupt:
+        pass
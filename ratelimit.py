@@ -0,0 +1,62 @@
+import logging
+import time
+from collections import defaultdict
+from typing import Dict, Mapping
+
+from tick_taker import OrderThrottled
+
+# Alpaca allows 200 REST requests a minute per account
+ACCOUNT_RATE = 200 / 60
+
+
+class OrderRateLimiter:
+    """Token bucket shared by every symbol's orders, holding back tokens from lower-priority symbols."""
+
+    def __init__(self, rate: float = ACCOUNT_RATE, burst: float = 10.0, priorities: Mapping[str, int] = None,
+                 reserve: float = 1.0):
+        # Tokens accrue at rate per second, up to burst. A symbol's priority is 0 (the default, and highest) or more;
+        # a symbol may only take a token while reserve tokens per priority level would be left for the symbols above
+        # it, so a burst on a low-priority symbol cannot use up the orders of the rest.
+        #
+        # The bucket takes no lock: orders are submitted from the stream's event loop, so only one thread touches it
+        self.rate = rate
+        self.burst = burst
+        self.priorities = dict(priorities or {})
+        self.reserve = reserve
+        self.tokens = burst
+        self.updated_ns = time.monotonic_ns()
+
+        # Counters, by symbol
+        self.allowed: Dict[str, int] = defaultdict(int)
+        self.throttled: Dict[str, int] = defaultdict(int)
+        self.rate_limited = 0
+
+    def refill(self):
+        now = time.monotonic_ns()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_ns) * self.rate / 1e9)
+        self.updated_ns = now
+
+    def acquire(self, symbol: str):
+        # Take a token for an order in symbol, or raise OrderThrottled if it has to wait for one
+        self.refill()
+        if self.tokens < 1.0 + self.priorities.get(symbol, 0) * self.reserve:
+            self.throttled[symbol] += 1
+            raise OrderThrottled(f'{symbol} order throttled ({self.tokens:.2f} tokens)')
+        self.tokens -= 1.0
+        self.allowed[symbol] += 1
+
+    def on_rate_limited(self):
+        # The broker answered 429 regardless, as other requests share the account's limit: stop sending until the
+        # bucket has refilled from empty
+        self.rate_limited += 1
+        self.tokens = 0.0
+        self.updated_ns = time.monotonic_ns()
+
+    def report(self) -> str:
+        return f'{self.rate_limited} rate limited by the broker; ' + ', '.join(
+            f'{symbol}: {self.throttled[symbol]}/{self.allowed[symbol] + self.throttled[symbol]} throttled'
+            for symbol in sorted(set(self.allowed) | set(self.throttled))
+        )
+
+    def dump(self):
+        logging.info(f'Order rate limiter: {self.report()}')
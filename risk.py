@@ -0,0 +1,196 @@
+import logging
+import time
+from collections import defaultdict, deque
+from typing import Deque, Dict, Mapping, Union
+
+from tick_taker import PRICE_SCALE, Order, Quote, RiskRejected
+
+
+class SymbolRisk:
+    """One symbol's position, quantity on open orders and the exposure they were last valued at."""
+
+    __slots__ = ('position', 'open_buy', 'open_sell', 'price_ticks', 'exposure')
+
+    def __init__(self, position: float = 0.0):
+        self.position = position
+        self.open_buy = 0.0
+        self.open_sell = 0.0
+        self.price_ticks = 0
+        self.exposure = 0.0
+
+    def worst_case(self, open_buy: float, open_sell: float) -> float:
+        # Shares held if every open order on one side filled and none on the other
+        return max(abs(self.position + open_buy), abs(self.position - open_sell))
+
+
+class RiskChecker:
+    """Pre-trade limits checked against counters kept up to date order by order, so each check is constant time."""
+
+    def __init__(self, max_notional: float = None, max_gross: float = None, max_open_orders: int = None,
+                 max_orders_per_second: int = None, price_band: float = None):
+        # Limits left as None are not checked:
+        #   max_notional:          dollars one symbol may be exposed to, counting every open order as filled
+        #   max_gross:             the same summed over every symbol
+        #   max_open_orders:       orders sent and not yet filled, cancelled, rejected or expired
+        #   max_orders_per_second: orders sent in any one-second window
+        #   price_band:            how far, as a fraction, a limit price may be through the quote it trades against
+        #
+        # Exposure is valued at the mid of each symbol's latest quote, and at an order's limit price as it is checked.
+        # Like the rate limiter, this takes no lock: quotes, orders and updates are only handled on the stream's event
+        # loop.
+        self.max_notional = max_notional * PRICE_SCALE if max_notional is not None else None
+        self.max_gross = max_gross * PRICE_SCALE if max_gross is not None else None
+        self.max_open_orders = max_open_orders
+        self.max_orders_per_second = max_orders_per_second
+        self.price_band = price_band
+
+        self.symbols: Dict[str, SymbolRisk] = {}
+        self.quotes: Dict[str, Quote] = {}
+        self.gross = 0.0
+
+        # Open orders we sent, with the quantity each still has booked against its symbol
+        self.open_orders: Dict[Order, float] = {}
+
+        # monotonic_ns at which each order in the last second was sent; stamped by on_sent, once the order has passed
+        # the rate limiter too, so orders dropped before reaching the broker do not use up the window
+        self.sent: Deque[int] = deque()
+
+        # Counters
+        self.checked = 0
+        self.rejected: Dict[str, int] = defaultdict(int)
+
+    def start(self, positions: Mapping[str, float]):
+        for symbol, position in positions.items():
+            self.symbol(symbol).position = position
+
+    def symbol(self, symbol: str) -> SymbolRisk:
+        risk = self.symbols.get(symbol)
+        if risk is None:
+            risk = self.symbols[symbol] = SymbolRisk()
+        return risk
+
+    def on_quote(self, quote: Quote):
+        # With reused quotes this is the runner's scratch quote, which stays current as it is overwritten
+        self.quotes[quote.symbol] = quote
+
+        # Mark a symbol we hold or have orders in to the new mid, so gross exposure counts it from its first quote
+        risk = self.symbols.get(quote.symbol)
+        if risk is not None:
+            risk.price_ticks = (quote.bid_ticks + quote.ask_ticks) // 2
+            self.revalue(risk)
+
+    def reject(self, reason: str, order: Order):
+        self.rejected[reason] += 1
+        raise RiskRejected(f'{order.symbol} {order.side} {order.quantity} rejected: {reason}')
+
+    def check(self, order: Order, limit_ticks: Union[int, None] = None):
+        # Book the order against every limit, or raise RiskRejected and leave the counters untouched
+        self.checked += 1
+        if self.max_open_orders is not None and len(self.open_orders) >= self.max_open_orders:
+            self.reject('open orders', order)
+
+        if self.max_orders_per_second is not None:
+            now = time.monotonic_ns()
+            sent = self.sent
+            while sent and now - sent[0] >= 1_000_000_000:
+                sent.popleft()
+            if len(sent) >= self.max_orders_per_second:
+                self.reject('orders per second', order)
+
+        symbol = order.symbol
+        is_buy = order.side == 'buy'
+        quote = self.quotes.get(symbol)
+        reference = 0
+        if quote is not None:
+            reference = quote.ask_ticks if is_buy else quote.bid_ticks
+        if self.price_band is not None and limit_ticks is not None:
+            if not reference:
+                self.reject('no quote', order)
+            if abs(limit_ticks - reference) > reference * self.price_band:
+                self.reject('price band', order)
+
+        risk = self.symbols.get(symbol)
+        if risk is None:
+            risk = self.symbols[symbol] = SymbolRisk()
+        price_ticks = limit_ticks or reference or risk.price_ticks
+        open_buy = risk.open_buy
+        open_sell = risk.open_sell
+        if is_buy:
+            open_buy += order.quantity
+        else:
+            open_sell += order.quantity
+        position = risk.position
+        shares = max(abs(position + open_buy), abs(position - open_sell))
+        exposure = shares * price_ticks
+        gross = self.gross - risk.exposure + exposure
+
+        # Orders that reduce exposure always pass, so a symbol or book over its limit can still be closed out. That is
+        # judged in shares, as valuing before and after at different prices would count a price move as the order's.
+        if shares > max(abs(position + risk.open_buy), abs(position - risk.open_sell)):
+            if self.max_notional is not None and exposure > self.max_notional:
+                self.reject('notional', order)
+            if self.max_gross is not None and gross > self.max_gross:
+                self.reject('gross exposure', order)
+
+        risk.open_buy = open_buy
+        risk.open_sell = open_sell
+        risk.price_ticks = price_ticks
+        risk.exposure = exposure
+        self.gross = gross
+        self.open_orders[order] = order.quantity
+
+    def on_sent(self, order: Order):
+        # Called once the order is on its way to the broker
+        if self.max_orders_per_second is not None:
+            self.sent.append(time.monotonic_ns())
+
+    def revalue(self, risk: SymbolRisk):
+        exposure = risk.worst_case(risk.open_buy, risk.open_sell) * risk.price_ticks
+        self.gross += exposure - risk.exposure
+        risk.exposure = exposure
+
+    def unbook(self, order: Order, quantity: float) -> SymbolRisk:
+        # Take quantity of the order off its symbol's open total
+        risk = self.symbols[order.symbol]
+        if order.is_buy:
+            risk.open_buy -= quantity
+        else:
+            risk.open_sell -= quantity
+        return risk
+
+    def on_order_failed(self, order: Order):
+        booked = self.open_orders.pop(order, None)
+        if booked is not None:
+            self.revalue(self.unbook(order, booked))
+
+    def on_trade_update(self, event: str, order: Order, data):
+        # Called before the strategies see the update; orders sent from elsewhere are not counted
+        booked = self.open_orders.get(order)
+        if booked is None:
+            return
+        if event == 'fill' or event == 'partial_fill':
+            remaining = order.quantity - float(data.order['filled_qty'])
+            risk = self.unbook(order, booked - remaining)
+            position_qty = getattr(data, 'position_qty', None)
+            if position_qty is not None:
+                risk.position = float(position_qty)
+            else:
+                risk.position += booked - remaining if order.is_buy else remaining - booked
+            if remaining > 0:
+                self.open_orders[order] = remaining
+            else:
+                del self.open_orders[order]
+            self.revalue(risk)
+        elif event == 'canceled' or event == 'rejected' or event == 'expired':
+            del self.open_orders[order]
+            self.revalue(self.unbook(order, booked))
+
+    def report(self) -> str:
+        return (
+            f'{self.checked} orders checked, {len(self.open_orders)} open, gross exposure '
+            f'{self.gross / PRICE_SCALE:,.2f}; rejected: '
+            + (', '.join(f'{reason} {count}' for reason, count in sorted(self.rejected.items())) or 'none')
+        )
+
+    def dump(self):
+        logging.info(f'Pre-trade risk: {self.report()}')
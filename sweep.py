@@ -0,0 +1,121 @@
+import argparse
+import csv
+import itertools
+import logging
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Tuple, Union
+
+import numpy as np
+
+from tape import TapeReader
+from tick_taker import IMBALANCE_THRESHOLD, MIN_TRADE_SIZE, STALE_NS
+from vectorized import simulate
+
+# Parameters swept, in results-table order; each is a TickTakerStrategy keyword argument
+PARAMETERS = ('imbalance_threshold', 'quantity_per_trade', 'stale_ns', 'min_trade_size', 'max_quantity')
+RESULTS = ('pnl', 'orders', 'fills', 'turnover')
+
+# Each worker process maps the tape's by-symbol index once and takes views of it, so the tick data is held once, in the
+# OS page cache, however many workers there are
+_tape: Union[TapeReader, None] = None
+_arrays: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+
+
+def open_tape(directory: str, symbols: List[str]):
+    global _tape
+    _tape = TapeReader(directory)
+    for symbol in symbols:
+        _arrays[symbol] = _tape.quotes_for(symbol), _tape.trades_for(symbol)
+
+
+def run(parameters: Dict[str, float], lot_size: int = 1) -> Dict[str, float]:
+    # Sum one parameter set's results across every symbol
+    totals = dict.fromkeys(RESULTS, 0)
+    for quotes, trades in _arrays.values():
+        result = simulate(quotes, trades, lot_size=lot_size, **parameters)
+        for key in RESULTS:
+            totals[key] += result[key]
+    return dict(parameters, **totals)
+
+
+def grid(**values: List[float]) -> List[Dict[str, float]]:
+    keys = list(values.keys())
+    return [dict(zip(keys, combination)) for combination in itertools.product(*values.values())]
+
+
+def sweep(directory: str, symbols: List[str], parameter_sets: List[Dict[str, float]], lot_size: int = 1,
+          workers: int = None) -> List[Dict[str, float]]:
+    # Index here, once, rather than in every worker
+    TapeReader(directory).index()
+    with ProcessPoolExecutor(max_workers=workers, initializer=open_tape, initargs=(directory, symbols)) as executor:
+        return list(executor.map(run, parameter_sets, itertools.repeat(lot_size), chunksize=1))
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.WARNING)
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        'tape', type=str,
+        help='Tape directory recorded with --record.'
+    )
+    parser.add_argument(
+        '--symbol', type=str, action='append', required=True,
+        help='Symbol to trade; repeat for several.'
+    )
+    parser.add_argument(
+        '--threshold', type=float, nargs='+', default=[IMBALANCE_THRESHOLD],
+        help='Bid/ask size imbalances to try.'
+    )
+    parser.add_argument(
+        '--quantity-per-trade', type=int, nargs='+', default=[100],
+        help='Shares per order to try.'
+    )
+    parser.add_argument(
+        '--stale-ms', type=float, nargs='+', default=[STALE_NS / 1e6],
+        help='Staleness windows after a level change to try, in milliseconds.'
+    )
+    parser.add_argument(
+        '--min-trade-size', type=int, nargs='+', default=[MIN_TRADE_SIZE],
+        help='Minimum trade sizes to try.'
+    )
+    parser.add_argument(
+        '--quantity', type=int, nargs='+', default=[500],
+        help='Maximum positions to try.'
+    )
+    parser.add_argument(
+        '--lot-size', type=int, default=1,
+        help='Shares per unit of quoted size.'
+    )
+    parser.add_argument(
+        '--workers', type=int, default=None,
+        help='Worker processes (defaults to one per CPU).'
+    )
+    parser.add_argument(
+        '--output', type=str, default=None,
+        help='Write the results table as CSV to this file instead of standard output.'
+    )
+    args = parser.parse_args()
+
+    parameter_sets = grid(
+        imbalance_threshold=args.threshold,
+        quantity_per_trade=args.quantity_per_trade,
+        stale_ns=[int(stale_ms * 1e6) for stale_ms in args.stale_ms],
+        min_trade_size=args.min_trade_size,
+        max_quantity=args.quantity
+    )
+    started = time.perf_counter()
+    results = sweep(args.tape, args.symbol, parameter_sets, args.lot_size, args.workers)
+    logging.warning(f'Swept {len(parameter_sets)} parameter sets in {time.perf_counter() - started:.2f}s')
+
+    results.sort(key=lambda result: result['pnl'], reverse=True)
+    output = open(args.output, 'w', newline='') if args.output else sys.stdout
+    try:
+        writer = csv.DictWriter(output, fieldnames=PARAMETERS + RESULTS)
+        writer.writeheader()
+        writer.writerows(results)
+    finally:
+        if output is not sys.stdout:
+            output.close()
@@ -0,0 +1,295 @@
+import heapq
+import logging
+import os
+import queue
+import struct
+import threading
+import time
+import uuid
+from typing import Dict, Iterator, List, Tuple, Union
+
+import numpy as np
+
+from tick_taker import Quote, Trade
+
+# Fixed-width little-endian records, one file per event kind, so a tape can be memory-mapped as an array of records
+#   quote:        timestamp ns, symbol id, bid ticks, ask ticks, bid size, ask size
+#   trade:        timestamp ns, symbol id, price ticks, size
+#   trade update: received ns, symbol id, event code, side (0 buy, 1 sell), order ID, quantity, filled quantity
+QUOTE_RECORD = struct.Struct('<qIqqII')
+TRADE_RECORD = struct.Struct('<qIqI')
+TRADE_UPDATE_RECORD = struct.Struct('<qIBB16sdd')
+
+# The same layouts as NumPy structured dtypes, for reading tapes in place
+QUOTE_DTYPE = np.dtype([
+    ('timestamp', '<i8'), ('symbol', '<u4'), ('bid', '<i8'), ('ask', '<i8'), ('bid_size', '<u4'), ('ask_size', '<u4')
+])
+TRADE_DTYPE = np.dtype([('timestamp', '<i8'), ('symbol', '<u4'), ('price', '<i8'), ('size', '<u4')])
+TRADE_UPDATE_DTYPE = np.dtype([
+    ('timestamp', '<i8'), ('symbol', '<u4'), ('event', 'u1'), ('side', 'u1'), ('order_id', 'S16'),
+    ('quantity', '<f8'), ('filled_quantity', '<f8')
+])
+
+# Records are converted to Python objects this many at a time when iterating
+CHUNK_RECORDS = 65536
+
+QUOTES_FILE = 'quotes.bin'
+TRADES_FILE = 'trades.bin'
+TRADE_UPDATES_FILE = 'trade_updates.bin'
+SYMBOLS_FILE = 'symbols.txt'
+
+# The same quote and trade records again, grouped by symbol and in time order within each, written by TapeReader.index
+QUOTES_BY_SYMBOL_FILE = 'quotes.by_symbol.bin'
+TRADES_BY_SYMBOL_FILE = 'trades.by_symbol.bin'
+
+# Trade update events by code; anything else is recorded as UNKNOWN_EVENT
+EVENTS = (
+    'new', 'fill', 'partial_fill', 'canceled', 'expired', 'done_for_day', 'replaced', 'rejected', 'pending_new',
+    'stopped', 'pending_cancel', 'pending_replace', 'calculated', 'suspended', 'order_replace_rejected',
+    'order_cancel_rejected'
+)
+EVENT_CODES = {event: code for code, event in enumerate(EVENTS)}
+UNKNOWN_EVENT = 255
+
+
+def order_id_bytes(order_id: str) -> bytes:
+    # Alpaca order IDs are UUIDs; anything else is kept as (truncated) UTF-8
+    try:
+        return uuid.UUID(order_id).bytes
+    except (TypeError, ValueError):
+        return (order_id or '').encode()[:16]
+
+
+class TapeWriter:
+    """Packs records into a fixed-size buffer on the caller's thread and hands full buffers to the recorder's writer."""
+
+    def __init__(self, recorder, path: str, record: struct.Struct, buffer_records: int):
+        self.recorder = recorder
+        self.path = path
+        self.record = record
+        self.buffer = bytearray(record.size * buffer_records)
+        self.offset = 0
+
+    def append(self, *values):
+        self.record.pack_into(self.buffer, self.offset, *values)
+        self.offset += self.record.size
+        if self.offset == len(self.buffer):
+            self.flush()
+
+    def flush(self):
+        if self.offset:
+            self.recorder.write(self.path, bytes(self.buffer[:self.offset]))
+            self.offset = 0
+
+
+class TapeRecorder:
+    """Appends every quote, trade and trade update the runner sees to a tape directory, writing on a background thread."""
+
+    def __init__(self, directory: str, buffer_records: int = 4096):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+        # Symbols are stored by ID; IDs continue from any symbols already on the tape
+        self.symbols: Dict[str, int] = {}
+        symbols_path = os.path.join(directory, SYMBOLS_FILE)
+        if os.path.exists(symbols_path):
+            with open(symbols_path) as file:
+                for line in file:
+                    self.symbols[line.rstrip('\n')] = len(self.symbols)
+
+        self.quotes = TapeWriter(self, os.path.join(directory, QUOTES_FILE), QUOTE_RECORD, buffer_records)
+        self.trades = TapeWriter(self, os.path.join(directory, TRADES_FILE), TRADE_RECORD, buffer_records)
+        self.trade_updates = TapeWriter(
+            self, os.path.join(directory, TRADE_UPDATES_FILE), TRADE_UPDATE_RECORD, buffer_records
+        )
+
+        self.pending: queue.SimpleQueue = queue.SimpleQueue()
+        self.thread: Union[threading.Thread, None] = threading.Thread(
+            target=self.drain, name='tape-writer', daemon=True
+        )
+        self.thread.start()
+
+    def symbol_id(self, symbol: str) -> int:
+        symbol_id = self.symbols.get(symbol)
+        if symbol_id is None:
+            symbol_id = self.symbols[symbol] = len(self.symbols)
+            self.write(os.path.join(self.directory, SYMBOLS_FILE), f'{symbol}\n'.encode())
+        return symbol_id
+
+    def record_quote(self, quote: Quote):
+        self.quotes.append(
+            quote.timestamp_ns,
+            self.symbol_id(quote.symbol),
+            quote.bid_ticks,
+            quote.ask_ticks,
+            quote.bid_size,
+            quote.ask_size
+        )
+
+    def record_trade(self, trade: Trade):
+        self.trades.append(trade.timestamp_ns, self.symbol_id(trade.symbol), trade.price_ticks, trade.size)
+
+    def record_trade_update(self, data):
+        order = data.order
+        self.trade_updates.append(
+            time.time_ns(),
+            self.symbol_id(order['symbol'].upper()),
+            EVENT_CODES.get(data.event, UNKNOWN_EVENT),
+            0 if order['side'].lower() == 'buy' else 1,
+            order_id_bytes(order['id']),
+            float(order['qty'] or 0),
+            float(order.get('filled_qty') or 0)
+        )
+
+    def write(self, path: str, chunk: bytes):
+        self.pending.put((path, chunk))
+
+    def drain(self):
+        # Keep files open for appending; a None marks the end of the tape
+        files = {}
+        try:
+            while True:
+                item = self.pending.get()
+                if item is None:
+                    return
+                path, chunk = item
+                file = files.get(path)
+                if file is None:
+                    file = files[path] = open(path, 'ab')
+                file.write(chunk)
+                if self.pending.empty():
+                    for file in files.values():
+                        file.flush()
+        except Exception as ex:
+            logging.exception(ex)
+        finally:
+            for file in files.values():
+                file.close()
+
+    def flush(self):
+        for writer in self.writers:
+            writer.flush()
+
+    @property
+    def writers(self) -> List[TapeWriter]:
+        return [self.quotes, self.trades, self.trade_updates]
+
+    def close(self):
+        if self.thread is None:
+            return
+        self.flush()
+        self.pending.put(None)
+        self.thread.join()
+        self.thread = None
+
+
+def map_records(path: str, dtype: np.dtype) -> np.ndarray:
+    # Read-only memory map of whole records; a partly written trailing record is ignored
+    size = os.path.getsize(path) if os.path.exists(path) else 0
+    count = size // dtype.itemsize
+    if count == 0:
+        return np.empty(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='r', shape=(count,))
+
+
+def write_by_symbol(records: np.ndarray, path: str, source: str):
+    # A stable sort keeps each symbol's records in time order. Only the sort order is held in memory: the records are
+    # gathered and written a chunk at a time, aside and then renamed, so readers never map half an index. The index
+    # takes the modification time of the tape it was written from, which is how readers tell it is still current.
+    modified = os.stat(source)
+    order = np.argsort(records['symbol'], kind='stable')
+    partial = path + '.partial'
+    with open(partial, 'wb') as file:
+        for start in range(0, len(order), CHUNK_RECORDS):
+            records[order[start:start + CHUNK_RECORDS]].tofile(file)
+    os.utime(partial, ns=(modified.st_atime_ns, modified.st_mtime_ns))
+    os.replace(partial, path)
+
+
+class TapeReader:
+    """Memory-maps a tape directory written by TapeRecorder; nothing is loaded until it is touched."""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        with open(os.path.join(directory, SYMBOLS_FILE)) as file:
+            self.symbols: List[str] = [line.rstrip('\n') for line in file]
+        self.symbol_ids: Dict[str, int] = {symbol: symbol_id for symbol_id, symbol in enumerate(self.symbols)}
+
+        self.quotes = map_records(os.path.join(directory, QUOTES_FILE), QUOTE_DTYPE)
+        self.trades = map_records(os.path.join(directory, TRADES_FILE), TRADE_DTYPE)
+        self.trade_updates = map_records(os.path.join(directory, TRADE_UPDATES_FILE), TRADE_UPDATE_DTYPE)
+
+        # Grouped copies, if index() has written them for the tape as it is now
+        self.quotes_by_symbol = self.map_index(QUOTES_BY_SYMBOL_FILE, QUOTES_FILE, self.quotes)
+        self.trades_by_symbol = self.map_index(TRADES_BY_SYMBOL_FILE, TRADES_FILE, self.trades)
+
+    def map_index(self, filename: str, source: str, records: np.ndarray) -> Union[np.ndarray, None]:
+        # An index is out of date if the tape has been written to since: appended to, so the sizes differ, or
+        # rewritten, so it no longer carries the tape's modification time
+        path = os.path.join(self.directory, filename)
+        source = os.path.join(self.directory, source)
+        if not os.path.exists(path) or not os.path.exists(source):
+            return None
+        stat = os.stat(path)
+        if stat.st_size != records.nbytes or stat.st_mtime_ns != os.stat(source).st_mtime_ns:
+            return None
+        return map_records(path, records.dtype)
+
+    def index(self):
+        # Write the quotes and trades grouped by symbol next to the tape, unless already up to date. quotes_for and
+        # trades_for then return slices of one memory map, shared by every process reading the tape, instead of
+        # each building its own copy.
+        directory = self.directory
+        if self.quotes_by_symbol is None and len(self.quotes):
+            write_by_symbol(
+                self.quotes, os.path.join(directory, QUOTES_BY_SYMBOL_FILE), os.path.join(directory, QUOTES_FILE)
+            )
+            self.quotes_by_symbol = self.map_index(QUOTES_BY_SYMBOL_FILE, QUOTES_FILE, self.quotes)
+        if self.trades_by_symbol is None and len(self.trades):
+            write_by_symbol(
+                self.trades, os.path.join(directory, TRADES_BY_SYMBOL_FILE), os.path.join(directory, TRADES_FILE)
+            )
+            self.trades_by_symbol = self.map_index(TRADES_BY_SYMBOL_FILE, TRADES_FILE, self.trades)
+
+    def records_for(self, records: np.ndarray, by_symbol: Union[np.ndarray, None], symbol: str) -> np.ndarray:
+        symbol_id = self.symbol_ids[symbol]
+        if by_symbol is None:
+            return records[records['symbol'] == symbol_id]
+        symbol_ids = by_symbol['symbol']
+        return by_symbol[symbol_ids.searchsorted(symbol_id, 'left'):symbol_ids.searchsorted(symbol_id, 'right')]
+
+    def quotes_for(self, symbol: str) -> np.ndarray:
+        # A view of the index when there is one, otherwise a copy
+        return self.records_for(self.quotes, self.quotes_by_symbol, symbol)
+
+    def trades_for(self, symbol: str) -> np.ndarray:
+        return self.records_for(self.trades, self.trades_by_symbol, symbol)
+
+    def iter_quotes(self) -> Iterator[Quote]:
+        # Yields one reused Quote per symbol, overwritten in place; strategies must snapshot() any they keep
+        scratch: Dict[int, Quote] = {}
+        symbols = self.symbols
+        for start in range(0, len(self.quotes), CHUNK_RECORDS):
+            for timestamp_ns, symbol_id, bid, ask, bid_size, ask_size in self.quotes[start:start + CHUNK_RECORDS].tolist():
+                quote = scratch.get(symbol_id)
+                if quote is None:
+                    quote = scratch[symbol_id] = Quote(symbols[symbol_id], bid, ask, bid_size, ask_size, timestamp_ns)
+                    yield quote
+                else:
+                    yield quote.update(bid, ask, bid_size, ask_size, timestamp_ns)
+
+    def events(self) -> Iterator[Tuple[str, int, str, int, int, int, int]]:
+        # Quotes and trades merged by timestamp, as backtest event tuples; at equal timestamps quotes come first
+        return heapq.merge(self.quote_events(), self.trade_events(), key=lambda event: event[1])
+
+    def quote_events(self) -> Iterator[Tuple[str, int, str, int, int, int, int]]:
+        symbols = self.symbols
+        for start in range(0, len(self.quotes), CHUNK_RECORDS):
+            for timestamp_ns, symbol_id, bid, ask, bid_size, ask_size in self.quotes[start:start + CHUNK_RECORDS].tolist():
+                yield 'Q', timestamp_ns, symbols[symbol_id], bid, ask, bid_size, ask_size
+
+    def trade_events(self) -> Iterator[Tuple[str, int, str, int, int, int, int]]:
+        symbols = self.symbols
+        for start in range(0, len(self.trades), CHUNK_RECORDS):
+            for timestamp_ns, symbol_id, price, size in self.trades[start:start + CHUNK_RECORDS].tolist():
+                yield 'T', timestamp_ns, symbols[symbol_id], price, size, 0, 0
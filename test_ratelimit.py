@@ -0,0 +1,55 @@
+import pytest
+
+from ratelimit import OrderRateLimiter
+from tick_taker import OrderThrottled
+
+
+def limiter(**params) -> OrderRateLimiter:
+    # A rate this low adds nothing measurable while a test runs, so the bucket only holds what it started with
+    return OrderRateLimiter(rate=1e-9, **params)
+
+
+def test_bucket_allows_a_burst_then_throttles():
+    rate_limiter = limiter(burst=3.0)
+    for _ in range(3):
+        rate_limiter.acquire('SNAP')
+    with pytest.raises(OrderThrottled):
+        rate_limiter.acquire('SNAP')
+    assert rate_limiter.allowed['SNAP'] == 3
+    assert rate_limiter.throttled['SNAP'] == 1
+
+
+def test_bucket_refills_at_rate():
+    rate_limiter = OrderRateLimiter(rate=10.0, burst=2.0)
+    rate_limiter.tokens = 0.0
+    rate_limiter.updated_ns -= 150_000_000
+    rate_limiter.acquire('SNAP')
+    with pytest.raises(OrderThrottled):
+        rate_limiter.acquire('SNAP')
+
+
+def test_lower_priority_leaves_reserve_for_higher():
+    rate_limiter = limiter(burst=5.0, priorities={'UVXY': 1, 'TSLA': 2}, reserve=2.0)
+
+    # UVXY must leave 2 tokens, and TSLA 4, for the symbols above them
+    rate_limiter.acquire('TSLA')
+    with pytest.raises(OrderThrottled):
+        rate_limiter.acquire('TSLA')
+    rate_limiter.acquire('UVXY')
+    rate_limiter.acquire('UVXY')
+    with pytest.raises(OrderThrottled):
+        rate_limiter.acquire('UVXY')
+
+    # The reserve is left for priority 0, which may take the last token
+    rate_limiter.acquire('SNAP')
+    rate_limiter.acquire('SNAP')
+    with pytest.raises(OrderThrottled):
+        rate_limiter.acquire('SNAP')
+
+
+def test_rate_limited_by_broker_empties_bucket():
+    rate_limiter = limiter(burst=10.0)
+    rate_limiter.on_rate_limited()
+    with pytest.raises(OrderThrottled):
+        rate_limiter.acquire('SNAP')
+    assert rate_limiter.rate_limited == 1
@@ -0,0 +1,102 @@
+from types import SimpleNamespace
+
+import pytest
+
+from ratelimit import OrderRateLimiter
+from risk import RiskChecker
+from tick_taker import PRICE_SCALE, Order, Quote, RiskRejected, Runner, TickTakerStrategy
+
+SYMBOL = 'SNAP'
+
+
+class StubBroker:
+    """Acknowledges every order with the next broker order ID."""
+
+    def __init__(self):
+        self.submitted = []
+
+    def submit_order(self, client_order_id: str = None, **params):
+        self.submitted.append(dict(params, client_order_id=client_order_id))
+        return SimpleNamespace(id=f'broker-{len(self.submitted)}', client_order_id=client_order_id)
+
+
+def runner_with(broker: StubBroker, risk: RiskChecker = None, rate_limiter: OrderRateLimiter = None):
+    # Without a running event loop the gateway submits inline, so each order is acknowledged before submit returns
+    runner = Runner(risk=risk, rate_limiter=rate_limiter)
+    runner.api = broker
+    strategy = TickTakerStrategy(SYMBOL, max_quantity=10_000, quantity_per_trade=100)
+    runner.add_strategy(strategy)
+    return runner, strategy
+
+
+def quote(symbol: str, bid: float, ask: float) -> Quote:
+    return Quote(symbol, round(bid * PRICE_SCALE), round(ask * PRICE_SCALE), 100, 100, 0)
+
+
+def test_sell_reducing_a_long_passes_after_the_price_moves_it_over_notional():
+    risk = RiskChecker(max_notional=1_500)
+    risk.start({'AAA': 100})
+    risk.on_quote(quote('AAA', 10.00, 10.02))
+    risk.check(Order('buy-1', 'AAA', 'buy', 40.0), 10_0200)
+    assert risk.open_orders
+
+    # Marked at the new mid, the position alone is now over the limit, so only orders that add to it are refused
+    risk.on_quote(quote('AAA', 20.00, 20.02))
+    with pytest.raises(RiskRejected):
+        risk.check(Order('buy-2', 'AAA', 'buy', 1.0), 20_0200)
+    risk.check(Order('sell-1', 'AAA', 'sell', 100.0), 20_0000)
+    assert risk.rejected == {'notional': 1}
+
+
+def test_gross_exposure_counts_held_positions_from_their_quotes():
+    risk = RiskChecker(max_gross=2_500)
+    risk.start({'BBB': 100})
+    assert risk.gross == 0
+    risk.on_quote(quote('BBB', 20.00, 20.02))
+    assert risk.gross == 100 * 20_0100
+
+    with pytest.raises(RiskRejected):
+        risk.check(Order('buy-1', 'CCC', 'buy', 100.0), 10_0000)
+    assert risk.rejected == {'gross exposure': 1}
+    assert risk.gross == 100 * 20_0100
+
+    # Once the held position is worth less, the same order fits
+    risk.on_quote(quote('BBB', 10.00, 10.02))
+    risk.check(Order('buy-2', 'CCC', 'buy', 100.0), 10_0000)
+    assert risk.gross == 100 * 10_0100 + 100 * 10_0000
+
+
+def test_failed_order_releases_its_exposure():
+    risk = RiskChecker(max_gross=1_500)
+    order = Order('buy-1', 'CCC', 'buy', 100.0)
+    risk.check(order, 10_0000)
+    with pytest.raises(RiskRejected):
+        risk.check(Order('buy-2', 'CCC', 'buy', 100.0), 10_0000)
+    risk.on_order_failed(order)
+    assert risk.gross == 0
+    assert not risk.open_orders
+    risk.check(Order('buy-3', 'CCC', 'buy', 100.0), 10_0000)
+
+
+def test_throttled_orders_do_not_count_towards_orders_per_second():
+    risk = RiskChecker(max_orders_per_second=3)
+    rate_limiter = OrderRateLimiter(rate=0.001, burst=3.0)
+    rate_limiter.tokens = 1.0
+    broker = StubBroker()
+    runner, strategy = runner_with(broker, risk, rate_limiter)
+    for _ in range(3):
+        strategy.submit_order('buy', 100, 10.0)
+    assert len(broker.submitted) == 1
+    assert risk.rejected == {}
+
+    # Only the order that reached the broker is in the window, so two more tokens let two more through
+    rate_limiter.tokens = 2.0
+    strategy.submit_order('buy', 100, 10.0)
+    strategy.submit_order('buy', 100, 10.0)
+    assert len(broker.submitted) == 3
+    assert risk.rejected == {}
+
+    rate_limiter.tokens = 1.0
+    strategy.submit_order('buy', 100, 10.0)
+    assert len(broker.submitted) == 3
+    assert risk.rejected == {'orders per second': 1}
@@ -0,0 +1,241 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from latency import LatencyMonitor
+from tick_taker import EPOCH, QUOTE, TRADE, EventQueue, Order, OrderStore, Runner, Strategy, TickTakerStrategy
+
+SYMBOL = 'SNAP'
+
+
+class StubBroker:
+    """Acknowledges every order with the next broker order ID, or raises the given error."""
+
+    def __init__(self, error: Exception = None):
+        self.error = error
+        self.submitted = []
+
+    def submit_order(self, client_order_id: str = None, **params):
+        if self.error is not None:
+            raise self.error
+        self.submitted.append(dict(params, client_order_id=client_order_id))
+        return SimpleNamespace(id=f'broker-{len(self.submitted)}', client_order_id=client_order_id)
+
+
+def runner_with(broker: StubBroker):
+    # Without a running event loop the gateway submits inline, so each order is acknowledged before submit returns
+    runner = Runner()
+    runner.api = broker
+    strategy = TickTakerStrategy(SYMBOL, max_quantity=500, quantity_per_trade=100)
+    runner.add_strategy(strategy)
+    return runner, strategy
+
+
+def update(event: str, order_id: str, side: str, qty: float, filled_qty: float, client_order_id: str = None):
+    return SimpleNamespace(event=event, order={
+        'id': order_id, 'client_order_id': client_order_id, 'symbol': SYMBOL, 'side': side, 'qty': str(qty),
+        'filled_qty': str(filled_qty)
+    })
+
+
+def test_order_counts_as_pending_until_acknowledged():
+    runner, strategy = runner_with(StubBroker())
+    order = strategy.submit_order('buy', 100, 10.0)
+    assert strategy.pending_buy == 100
+    assert strategy.total_position() == 100
+    assert order.id == 'broker-1'
+    assert 'broker-1' in runner.orders
+
+
+def test_partial_fill_then_cancel_moves_pending_into_position():
+    runner, strategy = runner_with(StubBroker())
+    strategy.submit_order('buy', 100, 10.0)
+    runner.dispatch_trade_update(update('partial_fill', 'broker-1', 'buy', 100, 40))
+    assert strategy.position == 40
+    assert strategy.pending_buy == 60
+    runner.dispatch_trade_update(update('partial_fill', 'broker-1', 'buy', 100, 70))
+    assert strategy.position == 70
+    assert strategy.pending_buy == 30
+    runner.dispatch_trade_update(update('canceled', 'broker-1', 'buy', 100, 70))
+    assert strategy.position == 70
+    assert strategy.pending_buy == 0
+    assert len(runner.orders) == 0
+
+
+def test_fill_settles_sell():
+    runner, strategy = runner_with(StubBroker())
+    strategy.position = 200
+    strategy.submit_order('sell', 100, 10.0)
+    assert strategy.pending_sell == 100
+    assert strategy.total_position() == 100
+    runner.dispatch_trade_update(update('fill', 'broker-1', 'sell', 100, 100))
+    assert strategy.position == 100
+    assert strategy.pending_sell == 0
+    assert len(runner.orders) == 0
+
+
+def test_failed_submission_releases_pending():
+    runner, strategy = runner_with(StubBroker(RuntimeError('insufficient buying power')))
+    strategy.submit_order('buy', 100, 10.0)
+    assert strategy.pending_buy == 0
+    assert strategy.total_position() == 0
+    assert len(runner.orders) == 0
+
+
+def test_repeated_tracking_counts_once():
+    runner, strategy = runner_with(StubBroker())
+    order = strategy.submit_order('buy', 100, 10.0)
+    strategy.track_order(order)
+    assert strategy.pending_buy == 100
+    strategy.untrack_order(order)
+    strategy.untrack_order(order)
+    assert strategy.pending_buy == 0
+
+
+def test_update_before_acknowledgement_rekeys_provisional_order():
+    # The trade update can beat submit_order's response; the provisional order is found by client order ID
+    runner, strategy = runner_with(StubBroker())
+    order = Order('client-1', SYMBOL, 'buy', 100.0)
+    runner.orders[order.id] = order
+    strategy.track_order(order)
+
+    runner.dispatch_trade_update(update('partial_fill', 'broker-9', 'buy', 100, 25, client_order_id='client-1'))
+    assert 'client-1' not in runner.orders
+    assert runner.orders['broker-9'] is order
+    assert order.id == 'broker-9'
+    assert strategy.pending_buy == 75
+
+    # The late acknowledgement finds nothing left to re-key
+    runner.acknowledge_order('client-1', 'broker-9')
+    assert runner.orders['broker-9'] is order
+    assert len(runner.orders) == 1
+
+
+@pytest.fixture
+def store():
+    store = OrderStore()
+    store['a'] = Order('a', 'SNAP', 'buy', 100.0)
+    store['b'] = Order('b', 'SNAP', 'sell', 100.0)
+    store['c'] = Order('c', 'UVXY', 'buy', 100.0)
+    return store
+
+
+def test_order_store_indexes_by_symbol(store):
+    assert set(store.for_symbol('SNAP')) == {'a', 'b'}
+    assert set(store.for_symbol('UVXY')) == {'c'}
+    assert len(store) == 3
+
+
+def test_order_store_view_is_live(store):
+    view = store.for_symbol('SNAP')
+    del store['a']
+    assert set(view) == {'b'}
+    store['d'] = Order('d', 'SNAP', 'buy', 100.0)
+    assert set(view) == {'b', 'd'}
+    with pytest.raises(TypeError):
+        view['e'] = Order('e', 'SNAP', 'buy', 100.0)
+
+
+def test_order_store_rekey_keeps_index_in_step(store):
+    order = store.pop('a')
+    order.id = 'broker-a'
+    store[order.id] = order
+    assert 'a' not in store
+    assert set(store.for_symbol('SNAP')) == {'b', 'broker-a'}
+    assert store.for_symbol('SNAP')['broker-a'] is order
+
+
+def test_order_store_replacing_with_another_symbol_moves_index(store):
+    store['a'] = Order('a', 'UVXY', 'buy', 100.0)
+    assert set(store.for_symbol('SNAP')) == {'b'}
+    assert set(store.for_symbol('UVXY')) == {'a', 'c'}
+
+
+class RecordingRunner:
+    """Stands in for the runner behind an EventQueue, recording what it is handed in order."""
+
+    def __init__(self):
+        self.handled = []
+
+    def on_quote(self, data):
+        self.handled.append(('quote', data.symbol, data.name))
+
+    def on_trade(self, data, received_ns: int = None):
+        self.handled.append(('trade', data.symbol, data.name))
+
+    def on_trade_updates(self, data):
+        self.handled.append(('update', data.symbol, data.name))
+
+
+def queued(events, conflate: bool = True):
+    # Queue every event before the dispatcher gets to run, then drain the lot
+    runner = RecordingRunner()
+    event_queue = EventQueue(runner, conflate)
+
+    async def put_all():
+        for kind, symbol, name in events:
+            data = SimpleNamespace(symbol=symbol, name=name)
+            if kind == 'update':
+                await event_queue.put_trade_update(data)
+            else:
+                await event_queue.put(kind, data)
+        event_queue.drain(len(events))
+        event_queue.task.cancel()
+
+    asyncio.run(put_all())
+    return runner.handled, event_queue
+
+
+def test_conflation_drops_unread_quotes_and_keeps_trades_in_order():
+    handled, event_queue = queued([
+        (QUOTE, 'SNAP', 'q1'), (QUOTE, 'SNAP', 'q2'), (TRADE, 'SNAP', 't1'), (QUOTE, 'SNAP', 'q3'),
+        (TRADE, 'SNAP', 't2'), (TRADE, 'SNAP', 't3'), (QUOTE, 'SNAP', 'q4'), (QUOTE, 'SNAP', 'q5'),
+    ])
+    assert handled == [
+        ('quote', 'SNAP', 'q2'), ('trade', 'SNAP', 't1'), ('quote', 'SNAP', 'q3'), ('trade', 'SNAP', 't2'),
+        ('trade', 'SNAP', 't3'), ('quote', 'SNAP', 'q5'),
+    ]
+    assert event_queue.conflated['SNAP'] == 2
+    assert event_queue.received['SNAP'] == 8
+
+
+def test_queue_without_conflation_keeps_every_quote():
+    handled, event_queue = queued([(QUOTE, 'SNAP', 'q1'), (QUOTE, 'SNAP', 'q2'), (TRADE, 'SNAP', 't1')], conflate=False)
+    assert [name for _, _, name in handled] == ['q1', 'q2', 't1']
+    assert event_queue.conflated['SNAP'] == 0
+
+
+def test_queue_takes_symbols_in_turn_and_trade_updates_first():
+    handled, _ = queued([
+        (TRADE, 'SNAP', 's1'), (TRADE, 'SNAP', 's2'), (TRADE, 'SNAP', 's3'), (TRADE, 'UVXY', 'u1'),
+        (TRADE, 'UVXY', 'u2'), ('update', 'SNAP', 'o1'),
+    ])
+    assert [name for _, _, name in handled] == ['o1', 's1', 'u1', 's2', 'u2', 's3']
+
+
+class ReceiptStrategy(Strategy):
+    """Records the receipt time the latency monitor holds for each trade as the trade is handled."""
+
+    def __init__(self, symbol: str):
+        super().__init__(symbol)
+        self.receipts = []
+
+    def on_trade(self, data):
+        self.receipts.append(self.runner.latency.received[self.symbol])
+
+
+def test_queued_trade_is_timed_from_its_own_receipt():
+    runner = Runner(latency=LatencyMonitor(), queue_size=10)
+    strategy = ReceiptStrategy(SYMBOL)
+    runner.add_strategy(strategy)
+
+    async def put_all():
+        for received_ns in (1_000, 2_000, 3_000):
+            data = SimpleNamespace(symbol=SYMBOL, price=10.0, size=100, timestamp=EPOCH)
+            await runner.event_queue.put(TRADE, data, received_ns)
+        runner.event_queue.drain(3)
+        runner.event_queue.task.cancel()
+
+    asyncio.run(put_all())
+    assert strategy.receipts == [1_000, 2_000, 3_000]
@@ -0,0 +1,55 @@
+import random
+from typing import List
+
+import pytest
+
+from backtest import BacktestRunner, Event
+from tick_taker import ONE_CENT, QUOTE, STALE_NS, TRADE, TickTakerStrategy
+from vectorized import check_parity
+
+SYMBOL = 'SNAP'
+
+
+def synthetic_events(seed: int, count: int = 5_000) -> List[Event]:
+    # A bid walking a cent at a time with one-cent, sub-cent and two-cent spreads, lopsided sizes, and trades at the
+    # touch, some too small and some inside the staleness window of the level they follow
+    rng = random.Random(seed)
+    events = []
+    timestamp_ns = 1_600_000_000_000_000_000
+    bid_ticks = 100_000
+    for _ in range(count):
+        timestamp_ns += rng.choice((1_000_000, STALE_NS // 2, STALE_NS * 2))
+        bid_ticks += rng.choice((-ONE_CENT, 0, ONE_CENT))
+        spread_ticks = rng.choice((ONE_CENT, ONE_CENT, ONE_CENT, ONE_CENT // 2, 2 * ONE_CENT))
+        bid_size, ask_size = rng.randint(1, 10), rng.randint(1, 10)
+        events.append((QUOTE, timestamp_ns, SYMBOL, bid_ticks, bid_ticks + spread_ticks, bid_size, ask_size))
+        if rng.random() < 0.7:
+            timestamp_ns += rng.choice((1_000_000, STALE_NS * 2))
+            price_ticks = rng.choice((bid_ticks, bid_ticks + spread_ticks))
+            events.append((TRADE, timestamp_ns, SYMBOL, price_ticks, rng.choice((50, 100, 300)), 0, 0))
+    return events
+
+
+@pytest.mark.parametrize('seed', [1, 2, 3])
+@pytest.mark.parametrize('lot_size, max_quantity, quantity_per_trade', [
+    # Quoted sizes of 1-10 shares: every fill is partial
+    (1, 500, 100),
+    # Whole fills, with the position limit reached after two orders
+    (100, 200, 100),
+    # Orders cut down to what the limit leaves
+    (10, 250, 100),
+])
+def test_vectorized_matches_event_driven(seed, lot_size, max_quantity, quantity_per_trade):
+    events = synthetic_events(seed)
+    assert check_parity(
+        events, SYMBOL, lot_size=lot_size, max_quantity=max_quantity, quantity_per_trade=quantity_per_trade
+    )
+
+
+def test_synthetic_events_trade():
+    # The parity cases above are only meaningful if the strategy actually orders and fills on these events
+    runner = BacktestRunner(lot_size=1)
+    runner.add_strategy(TickTakerStrategy(SYMBOL, max_quantity=200, quantity_per_trade=100))
+    summary = runner.run(synthetic_events(1))
+    assert summary['orders'] > 0
+    assert summary['fills'] > 0
@@ -1,55 +1,176 @@
 import argparse
+import asyncio
+import functools
 import logging
-from datetime import datetime
-from typing import List, Union, MutableMapping
+import logging.handlers
+import queue
+import signal
+import threading
+import time
+import uuid
+from collections import defaultdict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from types import MappingProxyType
+from typing import TYPE_CHECKING, Callable, Deque, Dict, Iterator, List, Mapping, Tuple, Union, MutableMapping
 
-import alpaca_trade_api as trade_api
-import numpy as np
-import pandas as pd
 import pytz
 
+# The SDK loads pandas and aiohttp, which take longer to import than everything else here put together, so it is only
+# imported once the runner goes live. Backtests and tools start without it; a live runner still pays for it in
+# Runner.start, before it subscribes.
+if TYPE_CHECKING:
+    import alpaca_trade_api as trade_api
+
 ABORT_IF_CLOSED = False
 IMBALANCE_THRESHOLD = 1.8
 
+# Trades this soon after a level change may still be reacting to the old level; smaller trades are noise
+STALE_NS = 50_000_000
+MIN_TRADE_SIZE = 100
+
+# Strategies with this symbol receive every event the runner sees
+ANY_SYMBOL = '*'
+
+# Event kinds, in queued and recorded events
+QUOTE = 'Q'
+TRADE = 'T'
+
+# Stream events a symbol may have waiting in its queue before the stream is held back
+QUEUE_SIZE = 1000
+
 TZ_NY = pytz.timezone('America/New_York')
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+# Prices are held as integer ticks of 1/100th of a cent, so sub-penny quotes survive the conversion
+PRICE_SCALE = 10_000
+ONE_CENT = PRICE_SCALE // 100
+
+
+def to_ticks(price) -> int:
+    return round(float(price) * PRICE_SCALE)
+
+
+def to_nanoseconds(timestamp) -> int:
+    # pandas Timestamps carry their epoch nanoseconds; plain datetimes only resolve to the microsecond
+    if hasattr(timestamp, 'value'):
+        return timestamp.value
+    return (timestamp - EPOCH) // timedelta(microseconds=1) * 1_000
+
+
+def from_nanoseconds(timestamp_ns: int) -> datetime:
+    return EPOCH + timedelta(microseconds=timestamp_ns // 1_000)
 
 
 class Quote:
-    def __init__(self, _symbol: str, _bid: float, _ask: float, _bid_size: float, _ask_size: float, _timestamp):
+    __slots__ = ('symbol', 'bid_ticks', 'ask_ticks', 'bid_size', 'ask_size', 'timestamp_ns', 'has_traded')
+
+    def __init__(self, _symbol: str, _bid_ticks: int, _ask_ticks: int, _bid_size: int, _ask_size: int, _timestamp_ns: int):
         self.symbol = _symbol
-        self.bid = _bid
-        self.ask = _ask
+        self.bid_ticks = _bid_ticks
+        self.ask_ticks = _ask_ticks
         self.bid_size = _bid_size
         self.ask_size = _ask_size
-        self.timestamp = _timestamp
+        self.timestamp_ns = _timestamp_ns
         self.has_traded = False
 
+    @property
+    def bid(self) -> float:
+        return self.bid_ticks / PRICE_SCALE
+
+    @property
+    def ask(self) -> float:
+        return self.ask_ticks / PRICE_SCALE
+
+    @property
+    def timestamp(self) -> datetime:
+        return from_nanoseconds(self.timestamp_ns)
+
+    @property
+    def spread_ticks(self) -> int:
+        return self.ask_ticks - self.bid_ticks
+
     @property
     def spread(self):
-        return round(self.ask - self.bid, 2)
+        return self.spread_ticks / PRICE_SCALE
 
     @staticmethod
     def from_data(data):
         return Quote(
             data.symbol,
-            float(data.bid_price),
-            float(data.ask_price),
-            float(data.bid_size),
-            float(data.ask_size),
-            data.timestamp
+            to_ticks(data.bid_price),
+            to_ticks(data.ask_price),
+            int(data.bid_size),
+            int(data.ask_size),
+            to_nanoseconds(data.timestamp)
         )
 
+    def update(self, _bid_ticks: int, _ask_ticks: int, _bid_size: int, _ask_size: int, _timestamp_ns: int):
+        # Overwrite this quote in place; used by the runner's scratch quotes to avoid allocating per tick
+        self.bid_ticks = _bid_ticks
+        self.ask_ticks = _ask_ticks
+        self.bid_size = _bid_size
+        self.ask_size = _ask_size
+        self.timestamp_ns = _timestamp_ns
+        self.has_traded = False
+        return self
+
+    def update_from_data(self, data):
+        return self.update(
+            to_ticks(data.bid_price),
+            to_ticks(data.ask_price),
+            int(data.bid_size),
+            int(data.ask_size),
+            to_nanoseconds(data.timestamp)
+        )
+
+    def snapshot(self):
+        # Strategies must keep a snapshot, not the quote they were handed, which may be reused for the next tick
+        quote = Quote(self.symbol, self.bid_ticks, self.ask_ticks, self.bid_size, self.ask_size, self.timestamp_ns)
+        quote.has_traded = self.has_traded
+        return quote
+
     def __repr__(self):
-        return f'Quote({self.timestamp.strftime("%H:%M:%S.%s")} for {self.symbol}: {self.bid} {self.ask} {self.bid_size}/{self.ask_size}; traded? {self.has_traded})'
+        return f'Quote({self.timestamp.strftime("%H:%M:%S.%f")} for {self.symbol}: {self.bid} {self.ask} {self.bid_size}/{self.ask_size}; traded? {self.has_traded})'
+
+
+class Trade:
+    # Compact trade print with the same attributes TickTakerStrategy.on_trade reads from the stream's trade entity
+    __slots__ = ('symbol', 'price_ticks', 'size', 'timestamp_ns')
+
+    def __init__(self, _symbol: str, _price_ticks: int, _size: int, _timestamp_ns: int):
+        self.symbol = _symbol
+        self.price_ticks = _price_ticks
+        self.size = _size
+        self.timestamp_ns = _timestamp_ns
+
+    @staticmethod
+    def from_data(data):
+        return Trade(data.symbol, to_ticks(data.price), int(data.size), to_nanoseconds(data.timestamp))
+
+    @property
+    def price(self) -> float:
+        return self.price_ticks / PRICE_SCALE
+
+    @property
+    def timestamp(self) -> datetime:
+        return from_nanoseconds(self.timestamp_ns)
+
+    def __repr__(self):
+        return f'Trade({self.timestamp.strftime("%H:%M:%S.%f")} for {self.symbol}: {self.size} @ {self.price})'
 
 
 class Order:
-    def __init__(self, _id: str, _symbol: str, _side: str, _quantity: float):
+    __slots__ = ('id', 'symbol', 'side', 'quantity', 'limit_price', 'filled_quantity', 'is_tracked')
+
+    def __init__(self, _id: str, _symbol: str, _side: str, _quantity: float, _limit_price: float = None):
         self.id = _id
         self.symbol = _symbol.upper()
         self.side = _side.lower()
         self.quantity = _quantity
+        self.limit_price = _limit_price
         self.filled_quantity: float = 0.0
+        self.is_tracked = False
 
     @staticmethod
     def from_data(data):
@@ -84,6 +205,48 @@ class Order:
         return self.side == 'sell'
 
 
+class OrderStore(MutableMapping[str, Order]):
+    """Open orders keyed by order ID, with a secondary index by symbol kept in step on insert and delete."""
+
+    def __init__(self):
+        self._by_id: Dict[str, Order] = {}
+        self._by_symbol: Dict[str, Dict[str, Order]] = defaultdict(dict)
+        self._views: Dict[str, Mapping[str, Order]] = {}
+
+    def __getitem__(self, order_id: str) -> Order:
+        return self._by_id[order_id]
+
+    def __setitem__(self, order_id: str, order: Order):
+        previous = self._by_id.get(order_id)
+        if previous is not None and previous.symbol != order.symbol:
+            del self._by_symbol[previous.symbol][order_id]
+        self._by_id[order_id] = order
+        self._by_symbol[order.symbol][order_id] = order
+
+    def __delitem__(self, order_id: str):
+        order = self._by_id.pop(order_id)
+        del self._by_symbol[order.symbol][order_id]
+
+    def __contains__(self, order_id) -> bool:
+        return order_id in self._by_id
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._by_id)
+
+    def __len__(self) -> int:
+        return len(self._by_id)
+
+    def for_symbol(self, symbol: str) -> Mapping[str, Order]:
+        """Read-only live view of the open orders for a symbol; no copy is made."""
+        view = self._views.get(symbol)
+        if view is None:
+            view = self._views[symbol] = MappingProxyType(self._by_symbol[symbol])
+        return view
+
+    def __repr__(self):
+        return f'OrderStore({list(self._by_id.values())})'
+
+
 class Strategy:
     def __init__(self, _symbol: str):
         self.runner = None
@@ -94,8 +257,10 @@ class Strategy:
         return self.runner.api
 
     @property
-    def orders(self):
-        return {order.id: order for order in self.runner.orders.values() if order.symbol == self.symbol}
+    def orders(self) -> Mapping[str, Order]:
+        if self.symbol == ANY_SYMBOL:
+            return self.runner.orders
+        return self.runner.orders.for_symbol(self.symbol)
 
     def start(self):
         pass
@@ -112,108 +277,680 @@ class Strategy:
     def on_trade_updates(self, event: str, order: Order, data):
         pass
 
+    def on_order_submitted(self, order: Order):
+        pass
+
+    def on_order_failed(self, order: Order, exception: Exception):
+        pass
+
+
+class OrderThrottled(Exception):
+    """Raised in place of submitting an order when the rate limiter has no token for it."""
+
+
+class RiskRejected(Exception):
+    """Raised in place of submitting an order that would breach a pre-trade risk limit."""
+
+
+class OrderGateway:
+    """Submits orders on a worker pool so REST round-trips never block the stream's event loop."""
+
+    def __init__(self, runner, max_workers: int = 4):
+        self.runner = runner
+        self.max_workers = max_workers
+        self.executor: Union[ThreadPoolExecutor, None] = None
+
+        # Set once stopped for liquidation; later orders fail rather than go out inline
+        self.closed = False
+
+    def start(self):
+        self.closed = False
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='order-gateway')
+
+    def stop(self, cancel: bool = False):
+        # With cancel, orders still waiting for a worker are dropped and no more are accepted; orders already being
+        # sent are waited for either way
+        if cancel:
+            self.closed = True
+        if self.executor is not None:
+            self.executor.shutdown(wait=True, cancel_futures=cancel)
+            self.executor = None
+
+    def submit(self, strategy, order: Order, **params):
+        if self.closed:
+            self.on_failed(strategy, order, RuntimeError(f'Order gateway closed; {order.symbol} order not sent'))
+            return
+
+        # An order that fails the risk checks, or that the rate limiter has no token for, fails straight away rather
+        # than waiting to go out late
+        runner = self.runner
+        if runner.risk is not None or runner.rate_limiter is not None:
+            try:
+                if runner.risk is not None:
+                    limit_price = params.get('limit_price')
+                    runner.risk.check(order, to_ticks(limit_price) if limit_price is not None else None)
+                if runner.rate_limiter is not None:
+                    runner.rate_limiter.acquire(order.symbol)
+            except Exception as ex:
+                self.on_failed(strategy, order, ex)
+                return
+            if runner.risk is not None:
+                runner.risk.on_sent(order)
+
+        # The order's ID is our client order ID until the broker acknowledges it
+        api = self.runner.order_api or self.runner.api
+        submit = functools.partial(api.submit_order, client_order_id=order.id, **params)
+        if self.runner.latency is not None:
+            submit = self.runner.latency.timed(order.symbol, submit)
+
+        # Without a running loop (or pool) there is nothing to hand the result back to, so submit inline
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        if loop is None or self.executor is None:
+            try:
+                entity = submit()
+            except Exception as ex:
+                self.on_failed(strategy, order, ex)
+            else:
+                self.on_submitted(strategy, order, entity)
+            return
+
+        future = loop.run_in_executor(self.executor, submit)
+        future.add_done_callback(functools.partial(self.on_done, strategy, order, order.id))
+
+    def on_done(self, strategy, order: Order, client_order_id: str, future: Future):
+        if future.cancelled():
+            self.on_failed(strategy, order, asyncio.CancelledError(f'Submission of {client_order_id} cancelled'))
+        elif future.exception() is not None:
+            self.on_failed(strategy, order, future.exception())
+        else:
+            self.on_submitted(strategy, order, future.result())
+
+    def on_submitted(self, strategy, order: Order, entity):
+        self.runner.acknowledge_order(entity.client_order_id, entity.id)
+        strategy.on_order_submitted(order)
+
+    def on_failed(self, strategy, order: Order, exception: Exception):
+        if self.runner.risk is not None:
+            self.runner.risk.on_order_failed(order)
+        if self.runner.rate_limiter is not None and getattr(exception, 'status_code', None) == 429:
+            self.runner.rate_limiter.on_rate_limited()
+        strategy.on_order_failed(order, exception)
+
+
+class ConnectionPool:
+    """Keeps a fixed set of persistent HTTPS connections to the REST API open and warm."""
+
+    def __init__(self, size: int = 4, keepalive_interval: float = 30.0, max_size: int = 0):
+        # size connections are kept warm; up to max_size are kept open when a burst of callers, such as liquidation,
+        # needs more at once
+        self.size = size
+        self.max_size = max(size, max_size)
+        self.keepalive_interval = keepalive_interval
+        self.api: Union['trade_api.REST', None] = None
+        self.stopped = threading.Event()
+        self.thread: Union[threading.Thread, None] = None
+
+    def mount(self, api: 'trade_api.REST'):
+        # Size the session's pool to match the number of concurrent callers, so no request opens a fresh connection
+        from requests.adapters import HTTPAdapter
+        self.api = api
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_size)
+        api._session.mount('https://', adapter)
+        api._session.mount('http://', adapter)
+
+    def warm(self):
+        # Issue one cheap request per pooled connection concurrently, so every connection completes TCP and TLS set-up now
+        try:
+            with ThreadPoolExecutor(max_workers=self.size, thread_name_prefix='http-warm') as executor:
+                list(executor.map(lambda _: self.api.get_clock(), range(self.size)))
+        except Exception as ex:
+            logging.warning(f'Could not warm REST connections: {ex}')
+
+    def start(self, api: 'trade_api.REST'):
+        self.mount(api)
+        self.warm()
+        if self.keepalive_interval:
+            self.stopped.clear()
+            self.thread = threading.Thread(target=self.keepalive, name='http-keepalive', daemon=True)
+            self.thread.start()
+
+    def keepalive(self):
+        # Re-warm periodically, so idle connections are not closed by the server before the next order
+        while not self.stopped.wait(self.keepalive_interval):
+            self.warm()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+
+class LogWriter:
+    """Writes log records to a file on a background thread, so a slow disk never stalls the event loop."""
+
+    def __init__(self, filename: str, batch_size: int = 512):
+        self.file_handler = logging.FileHandler(filename)
+        self.file_handler.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+        self.batch_size = batch_size
+        self.records = queue.SimpleQueue()
+        self.handler = logging.handlers.QueueHandler(self.records)
+        self.thread: Union[threading.Thread, None] = None
+
+    def start(self, level: int = logging.INFO):
+        # The queue handler formats each message on the logging thread, then hands the record over without blocking
+        root = logging.getLogger()
+        root.setLevel(level)
+        root.addHandler(self.handler)
+        self.thread = threading.Thread(target=self.drain, name='log-writer', daemon=True)
+        self.thread.start()
+
+    def drain(self):
+        # Take whatever has queued up, to batch_size records, and write and flush it in one go; a None means stop
+        stream = self.file_handler.stream
+        terminator = self.file_handler.terminator
+        while True:
+            batch = [self.records.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.records.get_nowait())
+                except queue.Empty:
+                    break
+            lines = []
+            for record in batch:
+                if record is None:
+                    break
+                try:
+                    lines.append(self.file_handler.format(record) + terminator)
+                except Exception:
+                    self.file_handler.handleError(record)
+            try:
+                stream.write(''.join(lines))
+                stream.flush()
+            except Exception:
+                self.file_handler.handleError(batch[0])
+            if record is None:
+                return
+
+    def stop(self):
+        if self.thread is None:
+            return
+        logging.getLogger().removeHandler(self.handler)
+        self.records.put(None)
+        self.thread.join()
+        self.thread = None
+        self.file_handler.close()
+
+
+class EventQueue:
+    """Per-symbol queues between the stream's callbacks and the strategies, optionally conflating unread quotes."""
+
+    def __init__(self, runner, conflate: bool = True, max_pending: int = QUEUE_SIZE, batch_size: int = 100):
+        # The stream's callbacks only enqueue; a dispatcher task on the stream's loop hands events to the runner, taking
+        # symbols in turn so a burst on one cannot hold up the rest. A callback for a symbol with max_pending events
+        # waiting blocks until the dispatcher catches up, which in turn stops the stream reading its socket.
+        self.runner = runner
+        self.conflate = conflate
+        self.max_pending = max_pending
+        self.batch_size = batch_size
+
+        # Each event is queued with the perf_counter_ns it was received at, if the runner measures latency
+        self.pending: Dict[str, Deque[Tuple[str, object, Union[int, None]]]] = defaultdict(deque)
+        self.ready: Deque[str] = deque()
+        self.trade_updates: Deque[object] = deque()
+        self.task: Union[asyncio.Task, None] = None
+        self.wakeup: Union[asyncio.Event, None] = None
+        self.space: Union[asyncio.Event, None] = None
+
+        # Counters, by symbol
+        self.received: Dict[str, int] = defaultdict(int)
+        self.conflated: Dict[str, int] = defaultdict(int)
+        self.max_depth: Dict[str, int] = defaultdict(int)
+
+    def start(self):
+        # Called from the first callback, as the stream creates its event loop when it runs
+        self.wakeup = asyncio.Event()
+        self.space = asyncio.Event()
+        self.task = asyncio.ensure_future(self.dispatch())
+
+    async def put(self, kind: str, data, received_ns: int = None):
+        if self.task is None:
+            self.start()
+        symbol = data.symbol
+        events = self.pending[symbol]
+        self.received[symbol] += 1
+
+        # A quote behind another quote nobody has seen yet replaces it; trades are never dropped, and a quote
+        # after a trade is kept so the trade is still handled against the quote it followed
+        if self.conflate and kind == QUOTE and events and events[-1][0] == QUOTE:
+            events[-1] = (kind, data, received_ns)
+            self.conflated[symbol] += 1
+            return
+
+        while len(events) >= self.max_pending:
+            self.space.clear()
+            await self.space.wait()
+        events.append((kind, data, received_ns))
+        if len(events) == 1:
+            self.ready.append(symbol)
+            self.wakeup.set()
+        if len(events) > self.max_depth[symbol]:
+            self.max_depth[symbol] = len(events)
+
+    async def put_trade_update(self, data):
+        # Order updates are never conflated or held back, and are handed over ahead of market data
+        if self.task is None:
+            self.start()
+        self.trade_updates.append(data)
+        self.wakeup.set()
+
+    async def dispatch(self):
+        while True:
+            if not self.ready and not self.trade_updates:
+                self.wakeup.clear()
+                await self.wakeup.wait()
+            self.drain(self.batch_size)
+
+            # Let the stream's callbacks queue up more between batches
+            await asyncio.sleep(0)
+
+    def drain(self, limit: int):
+        runner = self.runner
+        for _ in range(limit):
+            try:
+                if self.trade_updates:
+                    runner.on_trade_updates(self.trade_updates.popleft())
+                    continue
+                if not self.ready:
+                    return
+                symbol = self.ready.popleft()
+                events = self.pending[symbol]
+                kind, data, received_ns = events.popleft()
+                if events:
+                    self.ready.append(symbol)
+                if not self.space.is_set():
+                    self.space.set()
+                if kind == QUOTE:
+                    runner.on_quote(data)
+                else:
+                    runner.on_trade(data, received_ns)
+            except Exception as ex:
+                logging.exception(ex)
+
+    def report(self) -> str:
+        return ', '.join(
+            f'{symbol}: {self.conflated[symbol]}/{self.received[symbol]} conflated, max depth {self.max_depth[symbol]}'
+            for symbol in sorted(self.received)
+        )
+
+
+def call_concurrently(calls: List[Tuple[str, Callable]], max_workers: int, retries: int = 2, backoff: float = 0.5,
+                      thread_name_prefix: str = 'concurrent') -> Dict[str, Exception]:
+    # Make each labelled call on up to max_workers threads, retrying one that raises up to retries more times with
+    # exponential backoff. Returns the last exception of each call that never succeeded, by label.
+    def call_with_retries(label: str, call: Callable):
+        for attempt in range(retries + 1):
+            try:
+                call()
+                return None
+            except Exception as ex:
+                if attempt == retries:
+                    return ex
+                logging.warning(f'{label} failed ({ex}); retrying')
+                time.sleep(backoff * 2 ** attempt)
+
+    if not calls:
+        return {}
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(calls)), thread_name_prefix=thread_name_prefix) as executor:
+        results = list(executor.map(lambda labelled: call_with_retries(*labelled), calls))
+    return {label: ex for (label, _), ex in zip(calls, results) if ex is not None}
+
 
 class Runner:
-    def __init__(self):
+    def __init__(self, reuse_quotes: bool = False, order_workers: int = 4, http_pool_size: int = None, recorder=None,
+                 latency=None, queue_size: int = 0, conflate: bool = False,
+                 liquidation_workers: int = 16, liquidation_retries: int = 2, rate_limiter=None, risk=None):
         self.strategies: List[Strategy] = []
-        self.orders: MutableMapping[str, Order] = {}
+        self.orders: OrderStore = OrderStore()
+
+        # When reusing quotes, each symbol gets one scratch Quote that is overwritten on every tick
+        self.reuse_quotes = reuse_quotes
+        self.scratch_quotes: Dict[str, Quote] = {}
+
+        # Positions held when the runner started, by symbol
+        self.positions: Dict[str, float] = {}
+
+        # Routing index: symbol -> strategies for that symbol plus the wildcard strategies
+        self.routes: MutableMapping[str, List[Strategy]] = {}
+        self.wildcard_strategies: List[Strategy] = []
 
         # Prepare API and connection
         self.connection = None
-        self.api: Union[trade_api.REST, None] = None
+        self.api: Union['trade_api.REST', None] = None
+
+        # Client the gateway submits orders through, when it must differ from api
+        self.order_api: Union['trade_api.REST', None] = None
+        self.gateway = OrderGateway(self, order_workers)
+        self.pool = ConnectionPool(http_pool_size or order_workers + 1, max_size=liquidation_workers)
+
+        # Optional tape.TapeRecorder that captures every event the stream callbacks see
+        self.recorder = recorder
+
+        # Optional latency.LatencyMonitor that times each order from the trade that prompted it to its acknowledgement
+        self.latency = latency
+
+        # Optional ratelimit.OrderRateLimiter that holds order submissions under the account's request limit
+        self.rate_limiter = rate_limiter
+
+        # Optional risk.RiskChecker that every order must pass before it is sent
+        self.risk = risk
+
+        # Positions are closed this many at a time, each retried this many times before it is reported as failed
+        self.liquidation_workers = liquidation_workers
+        self.liquidation_retries = liquidation_retries
+
+        # Stream events go straight to the strategies, unless queued (and optionally conflated) per symbol
+        self.event_queue = EventQueue(self, conflate, queue_size or QUEUE_SIZE) if queue_size or conflate else None
 
     def add_strategy(self, *strategies: Strategy):
         for strategy in strategies:
             strategy.runner = self
             self.strategies.append(strategy)
+        self.build_routes()
+
+    def build_routes(self):
+        by_symbol = defaultdict(list)
+        wildcards = []
+        for strategy in self.strategies:
+            if strategy.symbol == ANY_SYMBOL:
+                wildcards.append(strategy)
+            else:
+                by_symbol[strategy.symbol].append(strategy)
+        self.wildcard_strategies = wildcards
+        self.routes = {symbol: routed + wildcards for symbol, routed in by_symbol.items()}
+
+    def strategies_for(self, symbol: str) -> List[Strategy]:
+        return self.routes.get(symbol, self.wildcard_strategies)
+
+    @property
+    def symbols(self) -> List[str]:
+        return list(self.routes.keys())
+
+    def quote_from_data(self, data) -> Quote:
+        if not self.reuse_quotes:
+            return Quote.from_data(data)
+        quote = self.scratch_quotes.get(data.symbol)
+        if quote is None:
+            quote = self.scratch_quotes[data.symbol] = Quote.from_data(data)
+            return quote
+        return quote.update_from_data(data)
+
+    def acknowledge_order(self, client_order_id: str, order_id: str):
+        # Re-key a provisional order from our client order ID to the broker's order ID, if not already done
+        order = self.orders.pop(client_order_id, None)
+        if order is not None:
+            order.id = order_id
+            self.orders[order_id] = order
+
+    def order_from_data(self, data) -> Order:
+        # Fetch or create the order based on the Order ID; updates can arrive before the submission is acknowledged
+        order_id = data.order['id']
+        if order_id not in self.orders:
+            self.acknowledge_order(data.order.get('client_order_id'), order_id)
+        if order_id not in self.orders:
+            self.orders[order_id] = Order.from_data(data)
+        return self.orders[order_id]
+
+    def dispatch_quote(self, quote: Quote):
+        for strategy in self.strategies_for(quote.symbol):
+            strategy.on_quote(quote)
+
+    def dispatch_trade(self, data):
+        for strategy in self.strategies_for(data.symbol):
+            strategy.on_trade(data)
+
+    def dispatch_trade_update(self, data):
+        order = self.order_from_data(data)
+        if self.risk is not None:
+            self.risk.on_trade_update(data.event, order, data)
+        for strategy in self.strategies_for(order.symbol):
+            strategy.on_trade_updates(data.event, order, data)
+
+    def on_quote(self, data):
+        quote = self.quote_from_data(data)
+        logging.debug('Received quote %s', quote)
+        if self.recorder is not None:
+            self.recorder.record_quote(quote)
+        if self.risk is not None:
+            self.risk.on_quote(quote)
+        self.dispatch_quote(quote)
+
+    def on_trade(self, data, received_ns: int = None):
+        # received_ns is when the stream handed the trade over, so time it spent queued counts towards its latency
+        trade = Trade.from_data(data)
+        logging.debug('Received trade %s', trade)
+        if self.latency is not None and received_ns is not None:
+            self.latency.on_receipt(trade.symbol, received_ns)
+        if self.recorder is not None:
+            self.recorder.record_trade(trade)
+        self.dispatch_trade(trade)
+
+    def on_trade_updates(self, data):
+        logging.debug('Received order %s', data)
+        if self.recorder is not None:
+            self.recorder.record_trade_update(data)
+        self.dispatch_trade_update(data)
+
+    def liquidate(self) -> Dict[str, Exception]:
+        # Runs on the liquidation timer's thread; stopping the stream waits for its event loop to acknowledge. The
+        # strategies then close out concurrently, so the last symbol is not left waiting on every other's round-trip.
+        # Returns why each symbol that could not be closed failed.
+        logging.info('Liquidating positions')
+        if self.connection is not None:
+            self.connection.stop()
+
+        # No order may go out during or after the closes, so drop those still queued and wait for any being sent
+        self.gateway.stop(cancel=True)
+        started = time.perf_counter()
+        failed = call_concurrently(
+            [(strategy.symbol, strategy.stop) for strategy in self.strategies],
+            self.liquidation_workers, self.liquidation_retries, thread_name_prefix='liquidate'
+        )
+        logging.info(
+            f'Liquidated {len(self.strategies) - len(failed)} of {len(self.strategies)} strategies '
+            f'in {time.perf_counter() - started:.3f}s'
+        )
+        if failed:
+            logging.error('Could not liquidate ' + ', '.join(f'{symbol} ({ex})' for symbol, ex in failed.items()))
+        return failed
 
     def start(self):
         # Prepare the API
         logging.info("Creating API...")
+        import alpaca_trade_api as trade_api
         self.api = trade_api.REST()
+        if self.rate_limiter is not None:
+            # The SDK sleeps and retries on a 429, which leaves an order seconds late; orders go through a client of
+            # their own that fails instead, and lets the rate limiter back off. It shares api's session, and so its
+            # warm connections, while start-up and liquidation keep the SDK's retries.
+            self.order_api = trade_api.REST()
+            self.order_api._retry = 0
+            self.order_api._session = self.api._session
+        self.pool.start(self.api)
 
         # Check if the market is open
         clock = self.api.get_clock()
         if ABORT_IF_CLOSED and clock.is_open is False:
             logging.warning(
                 f'Markets are closed (now {clock.timestamp.strftime("%a %-d %b %H:%M:%S")}). Next open is {clock.next_open.strftime("%a %-d %b %H:%M:%S")}')
+            self.pool.stop()
             return
 
         # Track when will close
-        liquidate_at = clock.next_close - pd.Timedelta(minutes=5)
+        liquidate_at = clock.next_close - timedelta(minutes=5)
         logging.info(f'Will liquidate positions at {liquidate_at.strftime("%a %-d %b %H:%M:%S")}.')
 
-        # Prepare all strategies
+        # Fetch every position in one request, rather than one per strategy, then prepare all strategies
+        self.positions = {position.symbol: float(position.qty) for position in self.api.list_positions()}
+        logging.info(f'Found positions in {len(self.positions)} symbols')
+        if self.risk is not None:
+            self.risk.start(self.positions)
         for strategy in self.strategies:
             strategy.start()
 
+        # Liquidate on a timer rather than checking the time on every quote, so it happens on time even if the market
+        # goes quiet. The delay is measured on the broker's clock and counted down on the monotonic clock.
+        liquidate_in = (liquidate_at - clock.timestamp).total_seconds()
+        if liquidate_in <= 0:
+            self.liquidate()
+            self.pool.stop()
+            return
+        timer = threading.Timer(liquidate_in, self.liquidate)
+        timer.daemon = True
+
+        event_queue = self.event_queue
+
         async def on_quote(data):
-            quote = Quote.from_data(data)
-            logging.debug(f'Received quote {quote}')
-            for strategy in self.strategies:
-                strategy.on_quote(quote)
-            # If closing...
-            if datetime.now(tz=TZ_NY) >= liquidate_at:
-                self.connection.stop()
-                for strategy in self.strategies:
-                    strategy.stop()
+            if event_queue is not None:
+                await event_queue.put(QUOTE, data)
+            else:
+                self.on_quote(data)
 
         async def on_trade(data):
-            logging.debug(f'Received trade {data.symbol} {data.size} @ {data.price}')
-            for strategy in self.strategies:
-                strategy.on_trade(data)
+            received_ns = time.perf_counter_ns() if self.latency is not None else None
+            if event_queue is not None:
+                await event_queue.put(TRADE, data, received_ns)
+            else:
+                self.on_trade(data, received_ns)
 
         async def on_trade_updates(data):
-            logging.debug(f'Received order {data}')
-            # Fetch or create the order based on the Order ID, then pass to strategy
-            order_id = data.order['id']
-            if order_id not in self.orders:
-                self.orders[order_id] = Order.from_data(data)
-            for strategy in self.strategies:
-                strategy.on_trade_updates(data.event, self.orders[order_id], data)
+            if event_queue is not None:
+                await event_queue.put_trade_update(data)
+            else:
+                self.on_trade_updates(data)
 
         # Configure connection
-        symbols = [strategy.symbol for strategy in self.strategies]
+        symbols = self.symbols if not self.wildcard_strategies else [ANY_SYMBOL]
         logging.info(f"Starting connection for {', '.join(symbols)}")
         self.connection = trade_api.Stream()
         self.connection.subscribe_quotes(on_quote, *symbols)
         self.connection.subscribe_trades(on_trade, *symbols)
         self.connection.subscribe_trade_updates(on_trade_updates)
-        self.connection.run()
+        self.gateway.start()
+        timer.start()
+        try:
+            self.connection.run()
+        finally:
+            # Let a liquidation already under way finish before shutting down
+            timer.cancel()
+            timer.join()
+            self.gateway.stop()
+            self.pool.stop()
+            if self.recorder is not None:
+                self.recorder.close()
+            if self.latency is not None:
+                self.latency.dump()
+            if self.rate_limiter is not None:
+                self.rate_limiter.dump()
+            if self.risk is not None:
+                self.risk.dump()
+            if self.event_queue is not None:
+                logging.info(f'Event queues: {self.event_queue.report()}')
 
 
 class TickTakerStrategy(Strategy):
-    def __init__(self, _symbol: str, max_quantity: int = 500, quantity_per_trade: int = 100):
+    def __init__(self, _symbol: str, max_quantity: int = 500, quantity_per_trade: int = 100,
+                 imbalance_threshold: float = IMBALANCE_THRESHOLD, stale_ns: int = STALE_NS,
+                 min_trade_size: int = MIN_TRADE_SIZE):
         super().__init__(_symbol)
         self.max_quantity = max_quantity
         self.quantity_per_trade = quantity_per_trade
-        self.current_quote = Quote(self.symbol, 0, 0, 0, 0, datetime.now(tz=TZ_NY))
-        self.previous_quote = Quote(self.symbol, 0, 0, 0, 0, datetime.now(tz=TZ_NY))
+        self.imbalance_threshold = imbalance_threshold
+        self.stale_ns = stale_ns
+        self.min_trade_size = min_trade_size
+        self.current_quote = Quote(self.symbol, 0, 0, 0, 0, time.time_ns())
+        self.previous_quote = Quote(self.symbol, 0, 0, 0, 0, time.time_ns())
+
+        # Trades up to this epoch nanosecond may still be reacting to the previous level
+        self.stale_until_ns = self.current_quote.timestamp_ns + stale_ns
         self.position = 0
         self.level_changes = 0
 
+        # Running totals of unfilled quantity across this symbol's open orders
+        self.pending_buy = 0.0
+        self.pending_sell = 0.0
+
     def start(self):
+        # Start from the position the runner found when it started
+        self.position = self.runner.positions.get(self.symbol, 0)
+        logging.info(f'Found {self.position} positions for {self.symbol}')
 
-        # Get current position
+    def stop(self):
+        # Liquidate position immediately. The SDK's APIError is matched by its code rather than imported, so that
+        # backtests never load the SDK.
         try:
-            data = self.api.get_position(self.symbol)
-            logging.debug(data)
-            self.position = float(data.qty)
-            logging.info(f'Found {self.position} positions for {self.symbol}')
-        except trade_api.rest.APIError as ex:
-            logging.warning(f'No positions for {self.symbol} found (code: {ex.code} / {ex})')
-            if ex.code == 40410000:
-                self.position = 0
-            else:
+            self.api.close_position(self.symbol)
+        except Exception as ex:
+            # 40410000: nothing to close
+            if getattr(ex, 'code', None) != 40410000:
                 raise
 
-    def stop(self):
-        # Liquidate position immediately
-        self.api.close_position(self.symbol)
-
     def total_position(self):
-        logging.debug([order.directional_quantity for order in self.orders.values()])
-        return self.position + sum([order.directional_quantity for order in self.orders.values()])
+        return self.position + self.pending_buy - self.pending_sell
+
+    def submit_order(self, side: str, quantity: float, limit_price: float):
+        # Count the order against our exposure immediately, rather than waiting for the broker to acknowledge it
+        order = Order(str(uuid.uuid4()), self.symbol, side, float(quantity), limit_price)
+        self.runner.orders[order.id] = order
+        self.track_order(order)
+        self.runner.gateway.submit(
+            self,
+            order,
+            symbol=self.symbol,
+            qty=str(quantity),
+            side=side,
+            type='limit',
+            time_in_force='ioc',
+            limit_price=str(limit_price)
+        )
+        return order
+
+    def on_order_submitted(self, order: Order):
+        # Logged only now, as an order may still be throttled, rejected or fail on its way to the broker
+        logging.info('%s at %s', 'Buy' if order.is_buy else 'Sell', order.limit_price)
+        logging.info('Order submitted %s', order)
+
+    def on_order_failed(self, order: Order, exception: Exception):
+        # Throttled orders are expected under load, and counted by the rate limiter
+        if isinstance(exception, OrderThrottled):
+            logging.debug('Order throttled %s', order)
+        elif isinstance(exception, RiskRejected):
+            logging.warning('Order %s', exception)
+        else:
+            logging.error('Order failed %s: %s', order, exception)
+        self.untrack_order(order)
+        self.runner.orders.pop(order.id, None)
+
+    def track_order(self, order: Order):
+        if order.is_tracked:
+            return
+        order.is_tracked = True
+        self.add_pending(order, order.pending)
+
+    def untrack_order(self, order: Order):
+        if not order.is_tracked:
+            return
+        order.is_tracked = False
+        self.add_pending(order, -order.pending)
+
+    def add_pending(self, order: Order, quantity: float):
+        if order.is_buy:
+            self.pending_buy += quantity
+        else:
+            self.pending_sell += quantity
 
     @property
     def can_buy(self):
@@ -233,124 +970,115 @@ class TickTakerStrategy(Strategy):
 
     def on_quote(self, quote: Quote):
         if (
-                self.current_quote.bid != quote.bid
-                and self.current_quote.ask != quote.ask
-                and quote.spread == 0.01
+                self.current_quote.bid_ticks != quote.bid_ticks
+                and self.current_quote.ask_ticks != quote.ask_ticks
+                and quote.spread_ticks == ONE_CENT
         ):
             self.previous_quote = self.current_quote
-            self.current_quote = quote
+            self.current_quote = quote.snapshot()
+            self.stale_until_ns = quote.timestamp_ns + self.stale_ns
             self.level_changes += 1
-            logging.debug(f'Level change: {self.previous_quote}, {self.current_quote}')
+            logging.debug('Level change: %s, %s', self.previous_quote, self.current_quote)
 
-    def on_trade(self, data):
+    def on_trade(self, data: Trade):
         # Ignore this trade if...
         # It is for a different symbol
         if data.symbol != self.symbol:
             # logging.debug('Ignoring trade - not the right symbol')
             return
 
-        # Log trade
-        logging.info(f'Received trade {data.symbol} {data.size} @ {data.price}')
-        logging.info(f'Latest quote {self.current_quote}')
+        # Log trade; every trade passes through here, so only at DEBUG, and without formatting unless enabled
+        logging.debug('Received trade %s', data)
+        logging.debug('Latest quote %s', self.current_quote)
 
         # We already traded on this level
         if self.current_quote.has_traded:
-            logging.info('Ignoring trade - already traded at this level')
+            logging.debug('Ignoring trade - already traded at this level')
             return
 
         # OR the trade is too close to the quote update so may be stale (for the old quote)
-        if data.timestamp <= self.current_quote.timestamp + pd.Timedelta(np.timedelta64(50, 'ms')):
-            logging.info('Ignoring trade - too recent')
+        if data.timestamp_ns <= self.stale_until_ns:
+            logging.debug('Ignoring trade - too recent')
             return
 
         # OR the trade size was too small
-        if data.size < 100:
-            logging.info('Ignoring trade - too small')
+        if data.size < self.min_trade_size:
+            logging.debug('Ignoring trade - too small')
             return
 
         quote = self.current_quote
+        price_ticks = data.price_ticks
 
         # Place a BUY order if...
         if (
-                data.price == quote.ask
-                and quote.bid_size > quote.ask_size * IMBALANCE_THRESHOLD
+                price_ticks == quote.ask_ticks
+                and quote.bid_size > quote.ask_size * self.imbalance_threshold
                 and self.can_buy
         ):
             try:
-                quote.traded = True
-                self.api.submit_order(
-                    symbol=self.symbol,
-                    qty=str(self.buyable_quantity),
-                    side='buy',
-                    type='limit',
-                    time_in_force='ioc',
-                    limit_price=str(quote.ask)
-                )
-
-                logging.info(f'Buy at {quote.ask}')
-
+                quote.has_traded = True
+                self.submit_order('buy', self.buyable_quantity, quote.ask)
             except Exception as e:
                 logging.exception(e)
-        else:
-            ask = data.price == quote.ask
-            imbalance = quote.bid_size > quote.ask_size * IMBALANCE_THRESHOLD
-            logging.debug(
-                f'Ask? {ask}; Imbalance? {imbalance}; Can buy? {self.can_buy}')
+        elif logging.root.isEnabledFor(logging.DEBUG):
+            ask = price_ticks == quote.ask_ticks
+            imbalance = quote.bid_size > quote.ask_size * self.imbalance_threshold
+            logging.debug('Ask? %s; Imbalance? %s; Can buy? %s', ask, imbalance, self.can_buy)
 
         # Place a SELL order if...
         if (
-                data.price == quote.bid
-                and quote.ask_size > quote.bid_size * IMBALANCE_THRESHOLD
+                price_ticks == quote.bid_ticks
+                and quote.ask_size > quote.bid_size * self.imbalance_threshold
                 and self.can_sell
         ):
             # Everything looks right, so we submit our sell at the bid
             try:
-                quote.traded = True
-                self.api.submit_order(
-                    symbol=self.symbol,
-                    qty=str(self.sellable_quantity),
-                    side='sell',
-                    type='limit',
-                    time_in_force='ioc',
-                    limit_price=str(quote.bid)
-                )
-                logging.info(f'Sell at {quote.bid}')
+                quote.has_traded = True
+                self.submit_order('sell', self.sellable_quantity, quote.bid)
             except Exception as e:
                 logging.exception(e)
-        else:
-            bid = data.price == quote.bid
-            imbalance = quote.ask_size > quote.bid_size * IMBALANCE_THRESHOLD
-            logging.debug(
-                f'Bid? {bid}; Imbalance? {imbalance}; Can sell? {self.can_sell}')
+        elif logging.root.isEnabledFor(logging.DEBUG):
+            bid = price_ticks == quote.bid_ticks
+            imbalance = quote.ask_size > quote.bid_size * self.imbalance_threshold
+            logging.debug('Bid? %s; Imbalance? %s; Can sell? %s', bid, imbalance, self.can_sell)
 
     def on_trade_updates(self, event, order: Order, data):
         # Ignore if not for the symbol we are watching
         if order.symbol != self.symbol:
             return
 
-        # Order was filled or partially filled; update it and if complete, settle it
+        # Orders placed outside this strategy are first seen here
+        self.track_order(order)
+
+        # Order was filled or partially filled; move the newly filled quantity from pending into position
         if event == 'fill' or event == 'partial_fill':
-            order.filled_quantity = float(data.order['filled_qty'])
+            filled_quantity = float(data.order['filled_qty'])
+            delta = filled_quantity - order.filled_quantity
+            order.filled_quantity = filled_quantity
+            self.add_pending(order, -delta)
+            self.position += delta if order.is_buy else -delta
             if order.is_filled:
                 self.on_order_settled(order)
 
-        # Cancelled or rejected
-        if event == 'canceled' or event == 'rejected':
+        # Cancelled, rejected or expired; release whatever was still pending
+        if event == 'canceled' or event == 'rejected' or event == 'expired':
             self.on_order_cancelled(event, order)
 
     def on_order_settled(self, order: Order):
-        logging.info(f'Order settled {order}')
-        self.position += order.directional_quantity
-        del self.runner.orders[order.id]
+        logging.info('Order settled %s', order)
+        self.untrack_order(order)
+        self.runner.orders.pop(order.id, None)
 
     def on_order_cancelled(self, event, order: Order):
-        logging.info(f'Order {event} {order}')
-        del self.runner.orders[order.id]
+        logging.info('Order %s %s', event, order)
+        self.untrack_order(order)
+        self.runner.orders.pop(order.id, None)
 
 
-if __name__ == '__main__':
+def main():
     logging_file = f'alpaca-algos-{datetime.now(tz=TZ_NY).strftime("%Y-%m-%d")}.log'
-    logging.basicConfig(filename=logging_file, level=logging.INFO)
+    log_writer = LogWriter(logging_file)
+    log_writer.start(logging.INFO)
 
     parser = argparse.ArgumentParser()
     parser.add_argument(
@@ -373,11 +1101,98 @@ if __name__ == '__main__':
         '--base-url', type=str, default=None,
         help='set https://paper-api.alpaca.markets if paper trading',
     )
+    parser.add_argument(
+        '--reuse-quotes', action='store_true',
+        help='Overwrite one quote object per symbol instead of allocating one per tick',
+    )
+    parser.add_argument(
+        '--record', type=str, default=None,
+        help='Directory to record every quote, trade and order update to',
+    )
+    parser.add_argument(
+        '--latency', action='store_true',
+        help='Measure tick-to-order latency; logged at exit, or on SIGUSR1',
+    )
+    parser.add_argument(
+        '--queue-size', type=int, default=0,
+        help='Queue stream events per symbol, blocking the stream when a symbol has this many waiting',
+    )
+    parser.add_argument(
+        '--conflate', action='store_true',
+        help='Queue stream events per symbol, keeping only the newest of any quotes not yet handled',
+    )
+    parser.add_argument(
+        '--order-rate', type=float, default=0,
+        help='Orders per second to stay under, across all symbols; orders beyond it are dropped',
+    )
+    parser.add_argument(
+        '--max-notional', type=float, default=None,
+        help='Reject orders that could take one symbol\'s exposure over this many dollars',
+    )
+    parser.add_argument(
+        '--max-gross', type=float, default=None,
+        help='Reject orders that could take gross exposure, across all symbols, over this many dollars',
+    )
+    parser.add_argument(
+        '--max-open-orders', type=int, default=None,
+        help='Reject orders while this many are open',
+    )
+    parser.add_argument(
+        '--max-orders-per-second', type=int, default=None,
+        help='Reject orders beyond this many in any one second',
+    )
+    parser.add_argument(
+        '--price-band-bps', type=float, default=None,
+        help='Reject limit orders priced more than this many basis points through the quote',
+    )
     args = parser.parse_args()
     assert args.quantity >= 100
-    runner = Runner()
+    recorder = None
+    if args.record:
+        from tape import TapeRecorder
+        recorder = TapeRecorder(args.record)
+    monitor = None
+    if args.latency:
+        from latency import LatencyMonitor
+        monitor = LatencyMonitor()
+        if hasattr(signal, 'SIGUSR1'):
+            signal.signal(signal.SIGUSR1, lambda signum, frame: monitor.dump())
+    rate_limiter = None
+    if args.order_rate:
+        from ratelimit import OrderRateLimiter
+        rate_limiter = OrderRateLimiter(args.order_rate)
+    risk = None
+    limits = (args.max_notional, args.max_gross, args.max_open_orders, args.max_orders_per_second, args.price_band_bps)
+    if any(limit is not None for limit in limits):
+        from risk import RiskChecker
+        risk = RiskChecker(
+            args.max_notional,
+            args.max_gross,
+            args.max_open_orders,
+            args.max_orders_per_second,
+            args.price_band_bps / 10_000 if args.price_band_bps is not None else None
+        )
+    runner = Runner(
+        reuse_quotes=args.reuse_quotes,
+        recorder=recorder,
+        latency=monitor,
+        queue_size=args.queue_size,
+        conflate=args.conflate,
+        rate_limiter=rate_limiter,
+        risk=risk
+    )
     runner.add_strategy(
         TickTakerStrategy(args.symbol, args.quantity, 100),
         TickTakerStrategy('UVXY', args.quantity, 100)
     )
-    runner.start()
+    try:
+        runner.start()
+    finally:
+        log_writer.stop()
+
+
+if __name__ == '__main__':
+    # Run as the tick_taker module, not as __main__: ratelimit and risk import their exceptions from tick_taker, and a
+    # second copy of this module would define classes that on_order_failed does not recognise
+    import tick_taker
+    tick_taker.main()
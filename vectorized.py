@@ -0,0 +1,196 @@
+import argparse
+import logging
+import os
+import time
+from typing import Dict, Iterable
+
+import numpy as np
+
+from backtest import QUOTE, BacktestRunner, Event, read_csv_events
+from tape import QUOTE_DTYPE, TRADE_DTYPE, TapeReader
+from tick_taker import IMBALANCE_THRESHOLD, MIN_TRADE_SIZE, ONE_CENT, PRICE_SCALE, STALE_NS, TickTakerStrategy
+
+
+def arrays_from_events(events: Iterable[Event], symbol: str):
+    # Split backtest event tuples for one symbol into quote and trade arrays with the tape's dtypes
+    quotes = []
+    trades = []
+    for kind, timestamp_ns, event_symbol, a, b, c, d in events:
+        if event_symbol != symbol:
+            continue
+        if kind == QUOTE:
+            quotes.append((timestamp_ns, 0, a, b, c, d))
+        else:
+            trades.append((timestamp_ns, 0, a, b))
+    return np.array(quotes, dtype=QUOTE_DTYPE), np.array(trades, dtype=TRADE_DTYPE)
+
+
+def level_changes(quotes: np.ndarray) -> np.ndarray:
+    # Indices of the quotes TickTakerStrategy.on_quote would accept as a new level. Only one-cent quotes qualify, and as
+    # every accepted quote is also one cent wide, "bid and ask both moved" reduces to "bid moved since the previous
+    # one-cent quote", whether or not that quote was accepted.
+    candidates = np.flatnonzero(quotes['ask'] - quotes['bid'] == ONE_CENT)
+    bids = quotes['bid'][candidates]
+    accepted = np.empty(len(candidates), dtype=bool)
+    if len(candidates):
+        accepted[0] = bids[0] != 0 and quotes['ask'][candidates[0]] != 0
+        accepted[1:] = bids[1:] != bids[:-1]
+    return candidates[accepted]
+
+
+def simulate(quotes: np.ndarray, trades: np.ndarray, max_quantity: int = 500, quantity_per_trade: int = 100,
+             imbalance_threshold: float = IMBALANCE_THRESHOLD, stale_ns: int = STALE_NS,
+             min_trade_size: int = MIN_TRADE_SIZE, lot_size: int = 1) -> Dict[str, float]:
+    # One symbol's quotes and trades, each ordered by timestamp, through the tick-taker rules and the backtest's fill
+    # model; returns the same summary as SimulatedBroker.summary()
+    levels = quotes[level_changes(quotes)]
+    trade_timestamps = trades['timestamp']
+    prices = trades['price']
+
+    # As-of join each trade to the level in force (for the signal) and to the latest quote (for the fill)
+    level = np.searchsorted(levels['timestamp'], trade_timestamps, side='right') - 1
+    latest = np.searchsorted(quotes['timestamp'], trade_timestamps, side='right') - 1
+    eligible = (level >= 0) & (trades['size'] >= min_trade_size)
+    level = np.maximum(level, 0)
+
+    level_bids = levels['bid'][level] if len(levels) else np.zeros(len(trades), dtype=np.int64)
+    level_asks = levels['ask'][level] if len(levels) else np.zeros(len(trades), dtype=np.int64)
+    level_bid_sizes = levels['bid_size'][level] if len(levels) else np.zeros(len(trades), dtype=np.uint32)
+    level_ask_sizes = levels['ask_size'][level] if len(levels) else np.zeros(len(trades), dtype=np.uint32)
+    if len(levels):
+        eligible &= trade_timestamps > levels['timestamp'][level] + stale_ns
+
+    buys = eligible & (prices == level_asks) & (level_bid_sizes > level_ask_sizes * imbalance_threshold)
+    sells = eligible & (prices == level_bids) & (level_ask_sizes > level_bid_sizes * imbalance_threshold)
+
+    # Position limits, one order per level and fills depend on earlier fills, so walk just the signalling trades
+    signals = np.flatnonzero(buys | sells)
+    is_buy = buys[signals].tolist()
+    signal_levels = level[signals].tolist()
+    limits = np.where(buys[signals], level_asks[signals], level_bids[signals]).tolist()
+    touch = latest[signals]
+    touch_asks = quotes['ask'][touch].tolist()
+    touch_bids = quotes['bid'][touch].tolist()
+    touch_ask_sizes = quotes['ask_size'][touch].tolist()
+    touch_bid_sizes = quotes['bid_size'][touch].tolist()
+
+    traded = set()
+    position = 0.0
+    cash = 0.0
+    orders = 0
+    fills = 0
+    turnover = 0.0
+    for i, signal_level in enumerate(signal_levels):
+        if signal_level in traded:
+            continue
+        if is_buy[i]:
+            if position >= max_quantity:
+                continue
+            quantity = min(quantity_per_trade, max_quantity - position)
+            filled = min(quantity, touch_ask_sizes[i] * lot_size) if limits[i] >= touch_asks[i] else 0.0
+            price_ticks = touch_asks[i]
+        else:
+            if position <= 0:
+                continue
+            quantity = min(quantity_per_trade, position)
+            filled = -min(quantity, touch_bid_sizes[i] * lot_size) if limits[i] <= touch_bids[i] else 0.0
+            price_ticks = touch_bids[i]
+        traded.add(signal_level)
+        orders += 1
+        if filled:
+            notional = filled * price_ticks / PRICE_SCALE
+            position += filled
+            cash -= notional
+            fills += 1
+            turnover += abs(notional)
+
+    # Liquidate at the last quote, as TickTakerStrategy.stop does
+    if position and len(quotes):
+        price_ticks = int(quotes['bid'][-1] if position > 0 else quotes['ask'][-1])
+        notional = -position * price_ticks / PRICE_SCALE
+        cash -= notional
+        fills += 1
+        turnover += abs(notional)
+
+    return {'pnl': cash, 'orders': orders, 'fills': fills, 'turnover': turnover}
+
+
+def check_parity(events: Iterable[Event], symbol: str, lot_size: int = 1, **parameters) -> bool:
+    # Run the event-driven backtest and the vectorized simulation over the same events and compare their summaries;
+    # parameters are TickTakerStrategy's keyword arguments
+    events = list(events)
+    runner = BacktestRunner(lot_size=lot_size)
+    runner.add_strategy(TickTakerStrategy(symbol, **parameters))
+    expected = runner.run(events)
+    actual = simulate(*arrays_from_events(events, symbol), lot_size=lot_size, **parameters)
+    matches = all(abs(expected[key] - actual[key]) < 1e-6 for key in expected)
+    if not matches:
+        logging.error(f'Vectorized {actual} does not match event-driven {expected} for {symbol}')
+    return matches
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.WARNING)
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        'events', type=str,
+        help='Tape directory recorded with --record, or a CSV of quotes and trades ordered by time.'
+    )
+    parser.add_argument(
+        '--symbol', type=str, action='append', required=True,
+        help='Symbol to trade; repeat for several.'
+    )
+    parser.add_argument(
+        '--quantity', type=int, default=500,
+        help='Maximum number of shares to hold at once.'
+    )
+    parser.add_argument(
+        '--threshold', type=float, default=IMBALANCE_THRESHOLD,
+        help='Bid/ask size imbalance required to trade.'
+    )
+    parser.add_argument(
+        '--lot-size', type=int, default=1,
+        help='Shares per unit of quoted size.'
+    )
+    parser.add_argument(
+        '--check-parity', action='store_true',
+        help='Also run the event-driven backtest and fail if the results differ.'
+    )
+    parser.add_argument(
+        '--quantity-per-trade', type=int, default=100,
+        help='Shares per order.'
+    )
+    parser.add_argument(
+        '--stale-ms', type=float, default=STALE_NS / 1e6,
+        help='Ignore trades this many milliseconds after a level change.'
+    )
+    parser.add_argument(
+        '--min-trade-size', type=int, default=MIN_TRADE_SIZE,
+        help='Ignore trades smaller than this.'
+    )
+    args = parser.parse_args()
+    parameters = {
+        'max_quantity': args.quantity,
+        'quantity_per_trade': args.quantity_per_trade,
+        'imbalance_threshold': args.threshold,
+        'stale_ns': int(args.stale_ms * 1e6),
+        'min_trade_size': args.min_trade_size
+    }
+
+    reader = TapeReader(args.events) if os.path.isdir(args.events) else None
+    for symbol in args.symbol:
+        if reader is not None:
+            quotes, trades = reader.quotes_for(symbol), reader.trades_for(symbol)
+        else:
+            quotes, trades = arrays_from_events(read_csv_events(args.events), symbol)
+        started = time.perf_counter()
+        result = simulate(quotes, trades, lot_size=args.lot_size, **parameters)
+        elapsed = time.perf_counter() - started
+        print(f'{symbol}: {len(quotes) + len(trades)} events in {elapsed:.3f}s; '
+              + ', '.join(f'{key}: {value:,.2f}' for key, value in result.items()))
+
+        if args.check_parity:
+            events = reader.events() if reader is not None else read_csv_events(args.events)
+            if not check_parity(events, symbol, args.lot_size, **parameters):
+                raise SystemExit(1)